@@ -1,8 +1,9 @@
 import sys
+import time
 import random
 import cv2
 from cvzone.FaceDetectionModule import FaceDetector
-from PySide6.QtCore import QTimer, Qt
+from PySide6.QtCore import QTimer, Qt, QThread, Signal
 from PySide6.QtGui import QImage, QPixmap
 from PySide6.QtWidgets import QApplication, QWidget, QLabel, QPushButton, QVBoxLayout, QProgressBar
 
@@ -46,9 +47,70 @@ class LoadingScreen(QWidget):
         self.setLayout(layout)
 
 
+def prepare_frame(img, size):
+    """摄像头画面镜像后缩放到显示尺寸，检测和显示都在这张图上进行"""
+    return cv2.resize(cv2.flip(img, 1), size)
+
+
+class StartupLoader(QThread):
+    """
+    后台完成启动准备：打开摄像头并取到第一帧，创建检测器并在第一帧上预热。
+    预热的检测结果就是主窗口显示的第一帧，界面线程不用再读取和检测一次。
+    各步骤完成的时间（相对启动时刻，毫秒）记录在 timings 中。
+    """
+    progress = Signal(str)
+    finished_loading = Signal(str)  # 错误信息，成功时为空
+
+    def __init__(self, start_time, display_size):
+        super().__init__()
+        self.start_time = start_time
+        self.display_size = display_size
+        self.cap = None
+        self.detector = None
+        self.first_frame = None  # 镜像并缩放到显示尺寸后的第一帧
+        self.first_faces = []
+        self.timings = {}
+
+    def mark(self, name):
+        self.timings[name] = (time.perf_counter() - self.start_time) * 1000
+
+    def run(self):
+        # ---------------- 摄像头 ----------------
+        self.progress.emit("正在打开摄像头...")
+        self.cap = cv2.VideoCapture(0)
+        # 设置摄像头分辨率
+        self.cap.set(3, 1280)
+        self.cap.set(4, 720)
+        self.mark("摄像头打开")
+        if self.cap.isOpened():
+            ret, img = self.cap.read()
+            if ret:
+                self.first_frame = prepare_frame(img, self.display_size)
+                self.mark("首帧")
+
+        # 使用长距离模型和更低的人脸检测阈值以提高检测率
+        self.progress.emit("正在初始化人脸检测模型...")
+        try:
+            self.detector = FaceDetector(minDetectionCon=0.25, modelSelection=1)
+            self.mark("模型加载")
+            # 在第一帧上检测一次，首次推理的开销不出现在实时画面中
+            if self.first_frame is not None:
+                _, faces = self.detector.findFaces(self.first_frame, draw=False)
+                self.first_faces = faces or []
+                self.mark("模型预热")
+        except Exception as e:
+            print(f"初始化人脸检测器时出错: {e}")
+            # 如果初始化失败，使用一个空的检测器
+            self.detector = None
+            self.finished_loading.emit(str(e))
+            return
+        self.finished_loading.emit("")
+
+
 class FaceRandomApp(QWidget):
     def __init__(self):
         super().__init__()
+        self.start_time = time.perf_counter()
         
         # 先显示加载页面
         self.loading_screen = LoadingScreen()
@@ -57,8 +119,8 @@ class FaceRandomApp(QWidget):
         # 强制立即处理GUI事件，确保加载页面能立即显示
         QApplication.processEvents()
         
-        # 延迟初始化主界面，让加载页面先显示
-        QTimer.singleShot(100, self.initialize_app)
+        # 摄像头和模型在后台准备，界面不需要再等待固定的时间
+        self.initialize_app()
 
     def initialize_app(self):
         # 设置窗口标题
@@ -70,44 +132,36 @@ class FaceRandomApp(QWidget):
         self.static_frame = None  # 保存随机状态下的静态画面
         self.all_faces_snapshot = []  # 保存所有人脸信息快照
 
-        # ---------------- 摄像头 ----------------
-        self.cap = cv2.VideoCapture(0)
-        
-        # 设置摄像头分辨率
-        self.cap.set(3, 1280)
-        self.cap.set(4, 720)
-        
+        self.cap = None
+        self.detector = None
+        self.faces = []
+
         # 设置窗口初始大小
         self.resize(1280, 720)
-        
-        # 更新加载页面文字，提示正在进行人脸模型初始化
-        self.loading_screen.loading_label.setText("正在初始化人脸检测模型...")
-        QApplication.processEvents()
-        
-        # 使用长距离模型和更低的人脸检测阈值以提高检测率
-        # 这里会加载模型，可能需要一些时间
-        try:
-            self.detector = FaceDetector(minDetectionCon=0.25, modelSelection=1)
-            self.loading_screen.loading_label.setText("人脸模型加载完成!")
-        except Exception as e:
-            print(f"初始化人脸检测器时出错: {e}")
-            # 如果初始化失败，使用一个空的检测器
-            self.detector = None
-            self.loading_screen.loading_label.setText("人脸模型加载失败，使用基础模式")
 
         # ---------------- 创建界面 ----------------
         self.setup_ui()
 
-        self.faces = []
-        
-        # 模拟加载完成
-        QTimer.singleShot(1500, self.finish_loading)
+        # 摄像头、首帧和检测模型都准备好后再显示主窗口
+        self.loader = StartupLoader(self.start_time, (self.video_label.width(), self.video_label.height()))
+        self.loader.progress.connect(self.loading_screen.loading_label.setText)
+        self.loader.finished_loading.connect(self.finish_loading)
+        self.loader.start()
+
+    def finish_loading(self, error):
+        self.loader.wait()
+        self.cap = self.loader.cap
+        self.detector = self.loader.detector
+        if error:
+            self.loading_screen.loading_label.setText("人脸模型加载失败，使用基础模式")
 
-    def finish_loading(self):
-        # 关闭加载页面
+        # 先显示后台已经检测好的第一帧，再关闭加载页面、显示主窗口
+        if self.loader.first_frame is not None:
+            self.show_live_frame(self.loader.first_frame, self.loader.first_faces)
         self.loading_screen.close()
-        # 显示主窗口
         self.show()
+        self.loader.mark("首帧显示")
+        print("启动耗时: " + ", ".join(f"{name} {ms:.0f} ms" for name, ms in self.loader.timings.items()))
         
         # 启动定时器更新视频帧
         self.timer = QTimer()
@@ -174,9 +228,8 @@ class FaceRandomApp(QWidget):
                 # 保存当前帧作为静态画面
                 ret, img = self.cap.read()
                 if ret:
-                    img = cv2.flip(img, 1)
-                    # 调整图像大小以适应窗口
-                    img = cv2.resize(img, (self.video_label.width(), self.video_label.height()))
+                    # 镜像并调整图像大小以适应窗口
+                    img = prepare_frame(img, (self.video_label.width(), self.video_label.height()))
                     self.static_frame = img.copy()
                     self.all_faces_snapshot = self.faces.copy()
         else:  # self.state == "random"
@@ -199,28 +252,15 @@ class FaceRandomApp(QWidget):
             if not ret:
                 return
 
-            img = cv2.flip(img, 1)
-            
-            # 调整图像大小以适应窗口
-            img = cv2.resize(img, (self.video_label.width(), self.video_label.height()))
+            # 镜像并调整图像大小以适应窗口
+            img = prepare_frame(img, (self.video_label.width(), self.video_label.height()))
 
             # 检测人脸
             if self.detector is not None:
                 img, faces = self.detector.findFaces(img, draw=False)
-                self.faces = faces if faces else []
             else:
-                self.faces = []
-
-            # 绘制所有人脸为绿色
-            for face in self.faces:
-                x, y, w, h = face["bbox"]
-                score = face["score"][0]
-                cv2.rectangle(img, (x, y), (x + w, y + h), (0, 255, 0), 3)
-                cv2.putText(img, f"{score:.2f}", (x, y - 10),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
-
-            # 显示图像
-            self.display_image(img)
+                faces = []
+            self.show_live_frame(img, faces)
 
         # ============================
         # 状态：random（显示静态画面，选中的人脸为红色，其他为绿色）
@@ -245,6 +285,19 @@ class FaceRandomApp(QWidget):
             # 显示图像
             self.display_image(img)
 
+    def show_live_frame(self, img, faces):
+        """记录检测结果，所有人脸画绿框后显示"""
+        self.faces = faces if faces else []
+        for face in self.faces:
+            x, y, w, h = face["bbox"]
+            score = face["score"][0]
+            cv2.rectangle(img, (x, y), (x + w, y + h), (0, 255, 0), 3)
+            cv2.putText(img, f"{score:.2f}", (x, y - 10),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+
+        # 显示图像
+        self.display_image(img)
+
     # ---------------------------------------------------------
     # 显示图像到 QLabel
     # ---------------------------------------------------------
@@ -257,7 +310,10 @@ class FaceRandomApp(QWidget):
 
     # ---------------------------------------------------------
     def closeEvent(self, event):
-        if self.cap.isOpened():
+        if hasattr(self, 'loader') and self.loader.isRunning():
+            self.loader.wait()
+            self.cap = self.loader.cap
+        if self.cap is not None and self.cap.isOpened():
             self.cap.release()
         event.accept()
 
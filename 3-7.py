@@ -1,11 +1,31 @@
 import sys
 import os
+import argparse
+import getpass
+import json
+import mmap
 import random
-import cv2
-import numpy as np
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# 启动前只导入 PySide6，加载界面出现后再在后台导入 cv2 和 numpy（见 import_heavy_modules）
+START_TIME = time.perf_counter()
 from PySide6.QtCore import QTimer, Qt, QThread, Signal
 from PySide6.QtGui import QImage, QPixmap
 from PySide6.QtWidgets import QApplication, QWidget, QLabel, QPushButton, QSlider, QVBoxLayout, QProgressBar
+IMPORT_TIMINGS = {"PySide6": (time.perf_counter() - START_TIME) * 1000}  # 各模块导入耗时（毫秒）
+
+cv2 = None
+np = None
+
+# 每次启动的耗时记录（每行一个 JSON）
+STARTUP_LOG_PATH = os.path.join(os.path.expanduser("~"), ".face_random", "startup.jsonl")
+
+MODEL_FILENAME = "face_detection_yunet_2023mar.onnx"
+# 打包时可以把模型字节生成为这个模块（见 --embed-model），运行时直接从内存加载
+EMBEDDED_MODEL_MODULE = "yunet_model"
 
 
 # ======================================================
@@ -37,6 +57,17 @@ class LoadingScreen(QWidget):
         """)
         layout.addWidget(self.loading_label)
 
+        # 并行进行的各项任务（摄像头、模型）各占一行
+        self.status_label = QLabel("")
+        self.status_label.setAlignment(Qt.AlignCenter)
+        self.status_label.setStyleSheet("""
+            color: white; 
+            font-size: 12px; 
+        """)
+        self.status_label.hide()
+        layout.addWidget(self.status_label)
+        self.statuses = {}
+
         # 进度条 - 设置为不确定模式，显示加载动画
         self.progress_bar = QProgressBar()
         self.progress_bar.setRange(0, 0)  # 设置为0,0表示不确定模式
@@ -56,17 +87,160 @@ class LoadingScreen(QWidget):
 
         self.setLayout(layout)
 
+    def set_status(self, task, message):
+        """更新某项任务的进度，所有任务按开始顺序逐行显示"""
+        self.statuses[task] = message
+        self.status_label.setText("\n".join(f"{name}：{text}" for name, text in self.statuses.items()))
+        self.status_label.show()
+
+
+# ======================================================
+# 延迟导入
+# ======================================================
+def import_heavy_modules():
+    """导入 numpy 和 cv2 并记录耗时；重复调用时直接返回"""
+    global cv2, np
+    if np is None:
+        start = time.perf_counter()
+        import numpy
+        np = numpy
+        IMPORT_TIMINGS["numpy"] = (time.perf_counter() - start) * 1000
+    if cv2 is None:
+        start = time.perf_counter()
+        import cv2 as cv2_module
+        cv2 = cv2_module
+        IMPORT_TIMINGS["cv2"] = (time.perf_counter() - start) * 1000
+    return IMPORT_TIMINGS
+
+
+def record_startup(timings, path=STARTUP_LOG_PATH):
+    """把本次启动的耗时追加到日志文件（打包后没有控制台，print 的内容看不到）"""
+    entry = {"time": time.strftime("%Y-%m-%d %H:%M:%S"), "script": os.path.basename(__file__)}
+    entry.update({name: round(ms, 1) for name, ms in timings.items()})
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    except OSError as e:
+        print(f"启动耗时记录写入失败: {e}")
+
+
+class ImportLoader(QThread):
+    """在后台导入 cv2 和 numpy，加载界面不会因为导入而迟迟不出现"""
+    imported = Signal(str)  # 错误信息，成功时为空
+    progress = Signal(str)
+
+    def run(self):
+        try:
+            self.progress.emit("正在加载运行库...")
+            import_heavy_modules()
+            self.imported.emit("")
+        except Exception as e:
+            self.imported.emit(f"{type(e).__name__}: {e}")
+
 
 # ======================================================
 # 模型加载线程
 # ======================================================
+def default_model_path():
+    """程序目录下 model 文件夹中的模型文件"""
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), "model", MODEL_FILENAME)
+
+
+def map_model_file(path):
+    """以只读内存映射打开模型文件，返回不复制数据的 uint8 数组（数组持有映射，映射随数组释放）"""
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return np.frombuffer(mapped, np.uint8)
+
+
+def load_embedded_model():
+    """读取打包进程序的模型字节，没有生成过嵌入模块时返回 None"""
+    try:
+        module = __import__(EMBEDDED_MODEL_MODULE)
+    except ImportError:
+        return None
+    return np.frombuffer(module.MODEL_DATA, np.uint8)
+
+
+def write_embedded_model(model_path, out_path):
+    """把模型文件写成 Python 模块，打包时编译进程序，不再需要单独的模型文件"""
+    with open(model_path, "rb") as f:
+        data = f.read()
+    with open(out_path, "w", encoding="utf-8") as f:
+        f.write(f"# 由 3-7.py --embed-model 从 {os.path.basename(model_path)} 生成，请勿手动修改\n")
+        f.write(f"MODEL_DATA = {data!r}\n")
+    return len(data)
+
+
+def create_detector(model, input_size=(320, 240), score_threshold=0.6):
+    """创建 YuNet 检测器；model 可以是模型文件路径，也可以是模型字节（uint8 数组）"""
+    if isinstance(model, str):
+        return cv2.FaceDetectorYN.create(
+            model,
+            "",
+            input_size,
+            score_threshold=score_threshold,
+            nms_threshold=0.3,
+            top_k=5000
+        )
+    # 从内存中的字节创建，不经过文件路径，非英文路径下也能加载
+    return cv2.FaceDetectorYN.create(
+        "onnx",
+        model,
+        np.empty(0, np.uint8),
+        input_size,
+        score_threshold=score_threshold,
+        nms_threshold=0.3,
+        top_k=5000
+    )
+
+
+
+def warm_up_detector(detector, size, runs=2):
+    """用空白画面按给定尺寸推理几次，网络内存分配和首次推理的开销提前付掉"""
+    w, h = size
+    detector.set_input_size((w, h))
+    dummy = np.full((h, w, 3), 127, np.uint8)
+    for _ in range(runs):
+        detector.detect(dummy)
+
+
 class ModelLoader(QThread):
     loaded = Signal(object, str)  # 模型加载完成信号
     progress = Signal(str)  # 进度更新信号
 
-    def __init__(self, model_path):
+    WARMUP_RUNS = 2  # 每个尺寸预热推理的次数：第一次分配网络内存，第二次稳定下来
+    WARMUP_WAIT = 10.0  # 预热完预计尺寸后最多等待多久摄像头的实际尺寸（秒），超时则不再等待
+
+    def __init__(self, model, tiling=None, warmup_sizes=None, backend="yunet"):
         super().__init__()
-        self.model_path = model_path
+        self.model = model  # 模型文件路径或模型字节，见 create_detector（只用于 YuNet）
+        self.tiling = tiling  # 分块检测参数（TiledDetector 的关键字参数），None 表示整幅检测
+        self.backend = backend  # 检测后端名称，见 DETECTOR_BACKENDS
+        # 预计的检测输入尺寸 (w, h)，加载后立即在这些尺寸上预热，不等摄像头打开；
+        # 摄像头打开后 set_warmup_sizes 给出实际尺寸，只补充预热还没预热过的尺寸
+        self.predicted_sizes = list(warmup_sizes or [])
+        self.warmup_sizes = []
+        self.warmup_ready = threading.Event()
+        self.timings = {}  # 各步骤耗时（毫秒）
+
+    def set_warmup_sizes(self, sizes):
+        """给出摄像头打开后的实际检测尺寸，可以在线程运行中调用"""
+        self.warmup_sizes = list(sizes)
+        self.warmup_ready.set()
+
+    def warm_up(self, detector, sizes, warmed):
+        """在加载界面还显示时，用空白画面按检测尺寸先推理几次，
+        网络内存分配和首次推理的开销不再出现在实时画面中；已预热的尺寸跳过"""
+        for w, h in sizes:
+            if (w, h) in warmed:
+                continue
+            self.progress.emit(f"正在预热模型 ({w}x{h})...")
+            start = time.perf_counter()
+            warm_up_detector(detector, (w, h), self.WARMUP_RUNS)
+            self.timings[f"warmup {w}x{h}"] = (time.perf_counter() - start) * 1000
+            warmed.add((w, h))
 
     def run(self):
         try:
@@ -80,14 +254,20 @@ class ModelLoader(QThread):
                 pass
 
             # 延迟加载检测器。
-            detector = cv2.FaceDetectorYN.create(
-                self.model_path,
-                "",
-                (320, 240),
-                score_threshold=0.6,
-                nms_threshold=0.3,
-                top_k=5000
-            )
+            start = time.perf_counter()
+            if self.backend == YuNetBackend.name:
+                detector = YuNetBackend(self.model, self.tiling)
+            else:
+                detector = create_backend(self.backend)
+            self.timings["load"] = (time.perf_counter() - start) * 1000
+
+            # 预热和打开摄像头同时进行；摄像头的实际尺寸和预计的一样时不再重复预热
+            warmed = set()
+            self.warm_up(detector, self.predicted_sizes, warmed)
+            if not self.warmup_ready.is_set():
+                self.progress.emit("等待摄像头...")
+            if self.warmup_ready.wait(self.WARMUP_WAIT):
+                self.warm_up(detector, self.warmup_sizes, warmed)
 
             self.progress.emit("模型加载完成")
             self.loaded.emit(detector, "")
@@ -95,12 +275,1844 @@ class ModelLoader(QThread):
             self.loaded.emit(None, str(e))
 
 
+# ======================================================
+# 性能统计
+# ======================================================
+class PerfStats:
+    """
+    滚动的分阶段耗时统计：每个阶段保留最近 capacity 个样本（结束时间, 毫秒），
+    供性能浮层显示，也可以导出为 CSV 或 JSON。未启用时各阶段不计时。
+    """
+
+    STAGE_NAMES = {
+        "capture": "采集",
+        "resize": "缩放",
+        "detect": "检测",
+        "track": "跟踪",
+        "draw": "绘制",
+        "display": "显示",
+    }
+
+    def __init__(self, capacity=600):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._rings = {}  # 阶段 -> [(capacity, 2) 数组, 已写入样本数]
+
+    def record(self, stage, start, end=None):
+        """记录一个阶段的耗时，start/end 为 time.perf_counter() 时间戳"""
+        if end is None:
+            end = time.perf_counter()
+        with self._lock:
+            ring = self._rings.get(stage)
+            if ring is None:
+                ring = self._rings[stage] = [np.zeros((self.capacity, 2)), 0]
+            ring[0][ring[1] % self.capacity] = (end, (end - start) * 1000)
+            ring[1] += 1
+
+    def samples(self, stage):
+        """按时间顺序返回某阶段保留的样本 (N, 2)"""
+        with self._lock:
+            ring = self._rings.get(stage)
+            if ring is None:
+                return np.zeros((0, 2))
+            data, count = ring
+            if count <= self.capacity:
+                return data[:count].copy()
+            start = count % self.capacity
+            return np.concatenate([data[start:], data[:start]])
+
+    def rate(self, stage, window=1.0):
+        """最近 window 秒内每秒的样本数，例如显示阶段即实际帧率"""
+        times = self.samples(stage)[:, 0]
+        if len(times) == 0:
+            return 0.0
+        recent = times[times >= time.perf_counter() - window]
+        return len(recent) / window
+
+    def summary(self, window=None):
+        """各阶段的次数、平均值和分位数（毫秒）；window 为秒数时只统计最近的样本"""
+        result = {}
+        for stage in list(self._rings):
+            samples = self.samples(stage)
+            if window is not None:
+                samples = samples[samples[:, 0] >= time.perf_counter() - window]
+            if len(samples) == 0:
+                continue
+            ms = samples[:, 1]
+            result[stage] = {
+                "count": int(len(ms)),
+                "mean": float(ms.mean()),
+                "p50": float(np.percentile(ms, 50)),
+                "p95": float(np.percentile(ms, 95)),
+                "max": float(ms.max()),
+            }
+        return result
+
+    def dump(self, path):
+        """导出统计：.csv 为逐样本明细，其他扩展名为 JSON（汇总 + 明细）"""
+        if path.lower().endswith(".csv"):
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("stage,time,ms\n")
+                for stage in list(self._rings):
+                    for t, ms in self.samples(stage):
+                        f.write(f"{stage},{t:.6f},{ms:.3f}\n")
+        else:
+            report = {
+                "summary": self.summary(),
+                "samples": {stage: self.samples(stage).tolist() for stage in list(self._rings)},
+            }
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+# ======================================================
+# 画面来源
+# ======================================================
+class FrameSource:
+    """
+    画面来源接口，与 cv2.VideoCapture 的 read/isOpened/set/get/release 用法一致，
+    CaptureThread 不区分摄像头和其他来源。
+
+    read(image) 在 image 尺寸匹配时把画面写入 image 并返回它（与 VideoCapture 相同），
+    采集线程的环形缓冲区依赖这一点避免重新分配。
+    非摄像头来源按 fps 控制出帧节奏，便于在没有摄像头的机器上以固定、可重复的帧率测试。
+    """
+
+    def __init__(self, fps=30.0):
+        self.fps = fps
+        self._next_time = None
+
+    def isOpened(self):
+        return True
+
+    def set(self, prop, value):
+        return False
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return float(self.fps or 0)
+        return 0.0
+
+    def release(self):
+        pass
+
+    def set_required_size(self, width, height):
+        """告知下游实际需要的最小分辨率（显示和检测），来源可以据此降低解码分辨率"""
+
+    @property
+    def unpaced(self):
+        """
+        不限速（fps 为 0）时出帧可能快于下游取走环形缓冲区里的画面，
+        采集线程交给下游之前要先复制，否则槽位会在被读取时被覆盖
+        """
+        return not self.fps
+
+    def read(self, image=None):
+        self._wait()
+        frame = self.next_frame()
+        if frame is None:
+            return False, None
+        if image is not None and image.shape == frame.shape and image.dtype == frame.dtype:
+            np.copyto(image, frame)
+            return True, image
+        return True, frame.copy()
+
+    def next_frame(self):
+        """返回下一帧（只读，调用方会复制），没有画面时返回 None"""
+        raise NotImplementedError
+
+    def _wait(self):
+        # 按固定时间表出帧；处理慢了不补帧，避免追赶时连续突发
+        if not self.fps:
+            return
+        period = 1.0 / self.fps
+        now = time.perf_counter()
+        if self._next_time is None or now - self._next_time > period:
+            self._next_time = now
+        elif self._next_time > now:
+            time.sleep(self._next_time - now)
+        self._next_time += period
+
+
+# 摄像头格式协商结果的缓存文件，下次启动直接按已知可用的设置打开
+CAMERA_CACHE_PATH = os.environ.get(
+    "FACE_RANDOM_CAMERA_CACHE",
+    os.path.join(os.path.expanduser("~"), ".face_random", "camera.json"),
+)
+
+
+def camera_backends():
+    """按平台列出依次尝试的采集后端，最后退回 OpenCV 自动选择"""
+    if sys.platform.startswith("win"):
+        # DirectShow 打开速度快且支持 MJPG，MSMF 作为备选
+        backends = [cv2.CAP_DSHOW, cv2.CAP_MSMF]
+    elif sys.platform == "darwin":
+        backends = [cv2.CAP_AVFOUNDATION]
+    else:
+        backends = [cv2.CAP_V4L2]
+    return backends + [cv2.CAP_ANY]
+
+
+def fourcc_text(code):
+    code = int(code)
+    return "".join(chr((code >> (8 * i)) & 0xFF) for i in range(4)).strip("\x00")
+
+
+def apply_camera_settings(cap, fourcc, width, height, fps, buffer_size=1):
+    """按顺序设置格式：部分后端必须先设 FOURCC 再设分辨率才会生效"""
+    if fourcc:
+        cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc))
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+    cap.set(cv2.CAP_PROP_FPS, fps)
+    # 缓冲区越小延迟越低；不是所有后端都支持
+    return bool(buffer_size) and cap.set(cv2.CAP_PROP_BUFFERSIZE, buffer_size)
+
+
+def measure_camera(cap, frames=15, warmup=3, timeout=2.0):
+    """读取若干帧，返回 (实际帧率, 画面尺寸 (w, h))；读取失败时返回 (0, None)"""
+    image = None
+    for _ in range(warmup):
+        ret, image = cap.read(image)
+        if not ret:
+            return 0.0, None
+    start = time.perf_counter()
+    count = 0
+    while count < frames and time.perf_counter() - start < timeout:
+        ret, image = cap.read(image)
+        if not ret:
+            break
+        count += 1
+    elapsed = time.perf_counter() - start
+    if count < 2 or image is None:
+        return 0.0, None
+    return count / elapsed, (image.shape[1], image.shape[0])
+
+
+def load_camera_cache(path=CAMERA_CACHE_PATH):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_camera_cache(cache, path=CAMERA_CACHE_PATH):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(cache, f, ensure_ascii=False, indent=2)
+    except OSError as e:
+        print(f"摄像头设置缓存写入失败: {e}")
+
+
+def camera_cache_key(index):
+    return f"{sys.platform}:{index}"
+
+
+def cached_camera_size(index=0, width=1280, height=720, path=CAMERA_CACHE_PATH):
+    """上次按同样请求分辨率协商出的实际画面尺寸 (w, h)，没有缓存时返回 None"""
+    cached = load_camera_cache(path).get(camera_cache_key(index))
+    if not cached or cached.get("requested") != [width, height]:
+        return None
+    return cached["width"], cached["height"]
+
+
+def open_cached_camera(index, settings):
+    """按缓存的设置打开摄像头并读一帧确认，失败时返回 None"""
+    cap = cv2.VideoCapture(index, settings["backend"])
+    if not cap.isOpened():
+        cap.release()
+        return None
+    apply_camera_settings(cap, settings["fourcc"], settings["width"], settings["height"],
+                          settings["fps"], settings.get("buffer_size", 0))
+    ret, frame = cap.read()
+    if not ret or frame is None or (frame.shape[1], frame.shape[0]) != (settings["width"], settings["height"]):
+        cap.release()
+        return None
+    return cap
+
+
+def negotiate_camera(index, width=1280, height=720, fps=30):
+    """
+    依次尝试后端和格式（MJPG 优先，其次 YUYV），测量实际出帧帧率，返回最好的 (cap, settings)。
+    达到目标分辨率且帧率接近目标时立即采用；都打不开时返回 (None, None)。
+    """
+    best = None  # (评分, settings)
+    for backend in camera_backends():
+        cap = cv2.VideoCapture(index, backend)
+        if not cap.isOpened():
+            cap.release()
+            continue
+        for fourcc in ("MJPG", "YUYV"):
+            buffer_ok = apply_camera_settings(cap, fourcc, width, height, fps)
+            measured, size = measure_camera(cap)
+            if size is None:
+                continue
+            actual_fourcc = fourcc_text(cap.get(cv2.CAP_PROP_FOURCC))
+            settings = {
+                "backend": backend,
+                "backend_name": cap.getBackendName(),
+                "fourcc": actual_fourcc if actual_fourcc in ("MJPG", "YUYV") else fourcc,
+                "width": size[0],
+                "height": size[1],
+                "requested": [width, height],  # 请求的分辨率，缓存按它匹配（摄像头实际给出的可能不同）
+                "fps": fps,
+                "buffer_size": 1 if buffer_ok else 0,
+                "measured_fps": round(measured, 1),
+            }
+            # 先比分辨率是否达标，再比实际帧率（超过目标帧率的部分不加分），最后比分辨率大小
+            score = (size[0] * size[1] >= width * height, min(measured, fps), size[0] * size[1])
+            if score[0] and measured >= 0.85 * fps:
+                return cap, settings
+            if best is None or score > best[0]:
+                best = (score, settings)
+        # 同一设备不能同时被两个后端打开，换后端之前先释放
+        cap.release()
+
+    if best is None:
+        return None, None
+    settings = best[1]
+    cap = open_cached_camera(index, settings)
+    return (cap, settings) if cap is not None else (None, None)
+
+
+class CameraSource(FrameSource):
+    """
+    摄像头（实时来源，出帧节奏由摄像头决定）。
+    首次使用时协商后端和格式并缓存结果，之后直接按缓存打开；缓存失效时重新协商。
+
+    reduced_decode 为 True 且摄像头输出 MJPG 时，关闭后端的颜色转换，直接取压缩数据，
+    按下游需要的分辨率用 IMREAD_REDUCED_COLOR_2/4/8 缩小解码；后端不支持时退回普通读取。
+    """
+
+    unpaced = False  # 出帧节奏由摄像头决定
+
+    # (缩小倍数, imdecode 标志名)，从大到小尝试
+    REDUCED_DECODE_FLAGS = (
+        (8, "IMREAD_REDUCED_COLOR_8"),
+        (4, "IMREAD_REDUCED_COLOR_4"),
+        (2, "IMREAD_REDUCED_COLOR_2"),
+    )
+
+    def __init__(self, index=0, width=1280, height=720, fps=30, probe=False, cache_path=CAMERA_CACHE_PATH,
+                 reduced_decode=False):
+        super().__init__(fps=None)
+        self.raw_mjpeg = False
+        self.required_size = None  # 下游需要的最小 (宽, 高)，None 表示原始分辨率
+        self.settings = None
+        key = camera_cache_key(index)
+        cache = load_camera_cache(cache_path)
+
+        cap = None
+        cached = cache.get(key)
+        if cached and not probe and cached.get("requested") == [width, height]:
+            cap = open_cached_camera(index, cached)
+            if cap is not None:
+                self.settings = cached
+        if cap is None:
+            cap, self.settings = negotiate_camera(index, width, height, fps)
+            if cap is not None:
+                cache[key] = self.settings
+                save_camera_cache(cache, cache_path)
+                print(f"摄像头协商结果: {self.settings['backend_name']} {self.settings['fourcc']} "
+                      f"{self.settings['width']}x{self.settings['height']} "
+                      f"实测 {self.settings['measured_fps']} fps")
+        # 打不开时保留一个未打开的 VideoCapture，与原来的行为一致
+        self.cap = cap if cap is not None else cv2.VideoCapture()
+
+        if reduced_decode and self.settings and self.settings["fourcc"] == "MJPG":
+            self.raw_mjpeg = bool(self.cap.set(cv2.CAP_PROP_CONVERT_RGB, 0))
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def set(self, prop, value):
+        return self.cap.set(prop, value)
+
+    def get(self, prop):
+        return self.cap.get(prop)
+
+    def release(self):
+        self.cap.release()
+
+    def set_required_size(self, width, height):
+        self.required_size = (width, height)
+
+    def grab(self):
+        """取走一帧但不解码：常驻服务空闲时用它让驱动缓冲区保持最新"""
+        return self.cap.grab()
+
+    def read(self, image=None):
+        if not self.raw_mjpeg:
+            return self.cap.read(image)
+
+        # 压缩数据长度每帧不同，不复用缓冲区
+        ret, raw = self.cap.read()
+        if not ret or raw is None:
+            return False, None
+        data = raw.reshape(-1)
+        if raw.ndim == 3 or data.size < 4 or data[0] != 0xFF or data[1] != 0xD8:
+            # 后端没有给出 JPEG 数据（忽略了设置或输出的是原始像素），退回普通读取
+            print("摄像头不支持读取原始 MJPG 数据，使用普通解码")
+            self.raw_mjpeg = False
+            self.cap.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+            return self.cap.read(image)
+
+        frame = cv2.imdecode(data, self._decode_flag())
+        if frame is None:
+            return False, None
+        if image is not None and image.shape == frame.shape:
+            np.copyto(image, frame)
+            return True, image
+        return True, frame
+
+    def _decode_flag(self):
+        """在不低于下游所需分辨率的前提下，选最大的缩小倍数"""
+        if self.required_size is None or not self.settings:
+            return cv2.IMREAD_COLOR
+        src_w, src_h = self.settings["width"], self.settings["height"]
+        need_w, need_h = self.required_size
+        for factor, flag in self.REDUCED_DECODE_FLAGS:
+            if src_w // factor >= need_w and src_h // factor >= need_h:
+                return getattr(cv2, flag)
+        return cv2.IMREAD_COLOR
+
+
+class VideoFileSource(FrameSource):
+    """视频文件，默认按文件自身的帧率播放，结束后从头循环"""
+
+    def __init__(self, path, fps=None, loop=True):
+        self.cap = cv2.VideoCapture(path)
+        file_fps = self.cap.get(cv2.CAP_PROP_FPS) if self.cap.isOpened() else 0
+        super().__init__(fps=fps if fps is not None else (file_fps or 30.0))
+        self.loop = loop
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return float(self.fps or 0)
+        return self.cap.get(prop)
+
+    def release(self):
+        self.cap.release()
+
+    def read(self, image=None):
+        self._wait()
+        ret, frame = self.cap.read(image)
+        if not ret and self.loop:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self.cap.read(image)
+        return ret, frame
+
+
+class ImageFolderSource(FrameSource):
+    """图片文件夹，按文件名顺序逐张作为画面，结束后从头循环"""
+
+    EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff")
+
+    def __init__(self, folder, fps=30.0, loop=True):
+        super().__init__(fps=fps)
+        self.loop = loop
+        self.paths = sorted(
+            os.path.join(folder, name) for name in os.listdir(folder)
+            if name.lower().endswith(self.EXTENSIONS)
+        )
+        self._index = 0
+        self._first_size = None
+
+    def isOpened(self):
+        return bool(self.paths)
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return float(len(self.paths))
+        if prop in (cv2.CAP_PROP_FRAME_WIDTH, cv2.CAP_PROP_FRAME_HEIGHT) and self.paths:
+            # 按第一张图片的尺寸报告
+            if self._first_size is None:
+                first = cv2.imdecode(np.fromfile(self.paths[0], np.uint8), cv2.IMREAD_COLOR)
+                self._first_size = first.shape[1::-1] if first is not None else (0, 0)
+            return float(self._first_size[0 if prop == cv2.CAP_PROP_FRAME_WIDTH else 1])
+        return super().get(prop)
+
+    def next_frame(self):
+        for _ in range(len(self.paths)):
+            if self._index >= len(self.paths):
+                if not self.loop:
+                    return None
+                self._index = 0
+            path = self.paths[self._index]
+            self._index += 1
+            # 用 imdecode 读取，路径中含中文时 imread 会失败
+            frame = cv2.imdecode(np.fromfile(path, np.uint8), cv2.IMREAD_COLOR)
+            if frame is not None:
+                return frame
+            print(f"无法读取图片: {path}")
+        return None
+
+
+class SyntheticSource(FrameSource):
+    """合成画面：带纹理的背景上有移动的色块，不含人脸，用于测量固定开销"""
+
+    def __init__(self, width=1280, height=720, fps=30.0, seed=0):
+        super().__init__(fps=fps)
+        rng = np.random.default_rng(seed)
+        self.background = cv2.GaussianBlur(rng.integers(0, 256, (height, width, 3), dtype=np.uint8), (0, 0), 3)
+        self.frame = np.empty_like(self.background)
+        self._count = 0
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.background.shape[1])
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.background.shape[0])
+        return super().get(prop)
+
+    def next_frame(self):
+        h, w = self.background.shape[:2]
+        size = min(200, w // 4, h // 4)
+        x = int((w - size) * (0.5 + 0.5 * np.sin(self._count / 15)))
+        y = h // 3
+        self._count += 1
+        np.copyto(self.frame, self.background)
+        cv2.rectangle(self.frame, (x, y), (x + size, y + size), (40, 180, 220), -1)
+        return self.frame
+
+
+def open_frame_source(spec=None, fps=None, probe_camera=False, reduced_decode=False):
+    """
+    按描述打开画面来源：
+      None / "camera" / "camera:1" / "1"  摄像头（默认 0 号）
+      "synthetic" / "synthetic:1920x1080"   合成画面
+      文件夹路径                            图片文件夹
+      其他路径                              视频文件
+    fps 只对非摄像头来源有效，0 表示不限速（尽可能快地出帧）；
+    probe_camera 为 True 时忽略缓存，重新协商摄像头格式；
+    reduced_decode 为 True 时摄像头的 MJPG 画面按需要的分辨率缩小解码。
+    """
+    spec = (spec or "camera").strip()
+    kind, _, arg = spec.partition(":")
+    if spec.isdigit():
+        return CameraSource(int(spec), probe=probe_camera, reduced_decode=reduced_decode)
+    if kind == "camera":
+        return CameraSource(int(arg) if arg else 0, probe=probe_camera, reduced_decode=reduced_decode)
+    if kind == "synthetic":
+        w, h = (int(v) for v in arg.lower().split("x")) if arg else (1280, 720)
+        return SyntheticSource(w, h, fps=30.0 if fps is None else fps)
+    if os.path.isdir(spec):
+        return ImageFolderSource(spec, fps=30.0 if fps is None else fps)
+    return VideoFileSource(spec, fps=fps)
+
+
+class UnavailableSource(FrameSource):
+    """打不开的画面来源，主界面照常显示黑屏"""
+
+    def isOpened(self):
+        return False
+
+    def read(self, image=None):
+        return False, None
+
+
+class CameraLoader(QThread):
+    """在后台打开画面来源：摄像头打开和格式协商往往要 1~3 秒，与模型加载同时进行"""
+    opened = Signal(object)  # 打开后的画面来源（可能未成功打开，需检查 isOpened）
+    progress = Signal(str)
+
+    def __init__(self, spec=None, fps=None, probe_camera=False, reduced_decode=False, use_service=False):
+        super().__init__()
+        self.args = (spec, fps, probe_camera, reduced_decode)
+        self.use_service = use_service  # 先尝试使用常驻服务开着的摄像头
+        self.timings = {}  # 各步骤耗时（毫秒）
+
+    def run(self):
+        self.progress.emit("正在打开...")
+        start = time.perf_counter()
+        try:
+            cap = ServiceSource.connect() if self.use_service else None
+            if cap is not None:
+                self.progress.emit("使用常驻服务")
+            else:
+                cap = open_frame_source(*self.args)
+        except Exception as e:
+            # 来源描述有误、文件夹无法读取、协商时 cv2 出错等：按打不开处理，启动流程照常继续
+            print(f"打开画面来源出错: {type(e).__name__}: {e}")
+            cap = UnavailableSource()
+        self.timings["open"] = (time.perf_counter() - start) * 1000
+        if not isinstance(cap, ServiceSource):
+            self.progress.emit("已打开" if cap.isOpened() else "打开失败")
+        self.opened.emit(cap)
+
+
+# ======================================================
+# 摄像头采集线程
+# ======================================================
+class CaptureThread(QThread):
+    """持续读取摄像头到预分配的环形缓冲区，只发布最新一帧，界面线程不再阻塞在 read() 上"""
+
+    def __init__(self, cap, outputs=(), ring_size=4):
+        super().__init__()
+        self.cap = cap
+        self.outputs = list(outputs)  # 下游各阶段的输入队列
+        self.perf = None  # 启用性能统计时为 PerfStats
+        # 至少3个槽位：一个正在写入、一个已发布、一个可能正被下游读取；
+        # 多留一个槽位，给下游取帧后复制留出余量
+        self.ring_size = max(3, ring_size)
+        self.ring = None  # 首帧到达后按实际分辨率分配
+        self._running = False
+        # 静止模式和随机冻结画面时暂停读取：摄像头只 grab() 不解码，其他来源直接等待
+        self._resume = threading.Event()
+        self._resume.set()
+
+        # 统计（丢帧由下游各队列统计）
+        self.frame_interval = 0.0  # 摄像头实际帧间隔（秒，指数滑动平均）
+        self._last_frame_time = None
+        self.captured_frames = 0
+
+    def run(self):
+        self._running = True
+        write_index = 0
+        cap = None
+        while self._running:
+            if self.cap is not cap:
+                # 首次运行或画面来源被替换（常驻服务断开后改用本地摄像头）
+                cap = self.cap
+                unpaced = getattr(cap, "unpaced", False)
+                grab = getattr(cap, "grab", None)
+            if not self._resume.is_set():
+                # 暂停期间摄像头仍取走新帧，驱动缓冲区保持最新，恢复后第一帧就是当前画面；
+                # 视频、图片等来源 grab() 会跳过内容，所以只等待恢复
+                if grab is None or not grab():
+                    self._resume.wait(0.1)
+                continue
+            slot = self.ring[write_index] if self.ring is not None else None
+            perf = self.perf
+            read_start = time.perf_counter() if perf else 0.0
+            ret, frame = cap.read(slot)
+            if perf:
+                perf.record("capture", read_start)
+            if not ret or frame is None:
+                self.msleep(5)
+                continue
+
+            if slot is None or frame is not slot:
+                # 首帧或分辨率变化：按新尺寸重新分配缓冲区
+                self.ring = [np.empty_like(frame) for _ in range(self.ring_size)]
+                self.ring[0][...] = frame
+                write_index = 0
+
+            # 记录摄像头实际的出帧节奏
+            now = time.perf_counter()
+            if self._last_frame_time is not None:
+                interval = now - self._last_frame_time
+                self.frame_interval = interval if self.frame_interval == 0 else 0.9 * self.frame_interval + 0.1 * interval
+            self._last_frame_time = now
+
+            self.captured_frames += 1
+
+            # 分发给下游阶段（队列满时丢弃最旧的帧）；不限速的来源先复制一份，
+            # 避免下游还没读完，槽位就被后面的帧覆盖
+            out = self.ring[write_index]
+            if unpaced:
+                out = out.copy()
+            for queue in self.outputs:
+                queue.put(out)
+
+            write_index = (write_index + 1) % self.ring_size
+
+    def set_source(self, cap):
+        """替换画面来源，采集循环下一轮开始读取新来源"""
+        self.cap = cap
+
+    def set_paused(self, paused):
+        if paused:
+            self._resume.clear()
+        else:
+            self._resume.set()
+
+    def stop(self):
+        self._running = False
+        self._resume.set()
+        self.wait()
+
+
+# ======================================================
+# 几何换算：检测分辨率与显示分辨率解耦
+# ======================================================
+# 检测输入宽度档位。检测尺寸只在这几个固定值之间取，
+# 推理开销不再随窗口大小变化，也不会反复 setInputSize
+DETECTION_WIDTHS = (320, 480, 640, 960, 1280, 1920)
+
+# YuNet 一行结果：x, y, w, h, 5个关键点 (x, y), score
+FACE_X_COLS = [0, 4, 6, 8, 10, 12]
+FACE_Y_COLS = [1, 5, 7, 9, 11, 13]
+
+
+def detection_size(frame_w, frame_h, max_width=None):
+    """计算检测输入尺寸：不超过上限时直接用摄像头原始分辨率，否则取不超过上限的最大档位"""
+    if max_width is None or frame_w <= max_width:
+        return frame_w, frame_h
+    width = max([w for w in DETECTION_WIDTHS if w <= max_width], default=DETECTION_WIDTHS[0])
+    return width, max(1, round(frame_h * width / frame_w))
+
+
+def detection_input(frame, max_width=None):
+    """生成检测输入：镜像，超过上限时先缩小到档位尺寸（缩小后再镜像，处理的像素更少）"""
+    frame_h, frame_w = frame.shape[:2]
+    det_w, det_h = detection_size(frame_w, frame_h, max_width)
+    if (det_w, det_h) != (frame_w, frame_h):
+        frame = cv2.resize(frame, (det_w, det_h), interpolation=cv2.INTER_AREA)
+    return cv2.flip(frame, 1)
+
+
+def cover_transform(src_w, src_h, dst_w, dst_h):
+    """resize_cover 的几何参数：缩放比例以及缩放后裁剪的偏移量"""
+    scale = max(dst_w / src_w, dst_h / src_h)
+    new_w = int(src_w * scale)
+    new_h = int(src_h * scale)
+    return scale, (new_w - dst_w) // 2, (new_h - dst_h) // 2
+
+
+class CoverGeometry:
+    """
+    预先算好的一组 (源尺寸, 目标尺寸) 的 resize_cover 几何参数。
+    先裁出源图中最终可见的区域，再缩放进预分配的连续输出缓冲区；
+    镜像放在源区域和输出中较小的一侧做，不再对整帧 flip 和 resize。
+    """
+
+    POOL_SIZE = 3  # 输出缓冲区轮换使用，下游取走后有足够时间显示或复制
+
+    def __init__(self, src_shape, target_w, target_h, mirror=False):
+        src_h, src_w = src_shape[:2]
+        self.scale, self.x_off, self.y_off = cover_transform(src_w, src_h, target_w, target_h)
+        self.target_size = (target_w, target_h)
+        self.mirror = mirror
+
+        # 输出画面对应的源图区域（镜像时在源图中取对称的区域）
+        x0 = self.x_off / self.scale
+        x1 = (self.x_off + target_w) / self.scale
+        if mirror:
+            x0, x1 = src_w - x1, src_w - x0
+        y0 = self.y_off / self.scale
+        y1 = (self.y_off + target_h) / self.scale
+        x0, x1 = max(0, round(x0)), min(src_w, max(round(x0) + 1, round(x1)))
+        y0, y1 = max(0, round(y0)), min(src_h, max(round(y0) + 1, round(y1)))
+        self.roi = (slice(y0, y1), slice(x0, x1))
+
+        extra = tuple(src_shape[2:])
+        self.flip_source = mirror and (x1 - x0) * (y1 - y0) < target_w * target_h
+        self._flip_buffer = np.empty((y1 - y0, x1 - x0) + extra, np.uint8) if self.flip_source else None
+        self._outputs = [np.empty((target_h, target_w) + extra, np.uint8) for _ in range(self.POOL_SIZE)]
+        self._next = 0
+
+    def apply(self, src, avoid=None):
+        """avoid: 仍被界面持有的输出缓冲区，本次不会覆盖它"""
+        out = self._outputs[self._next]
+        if out is avoid:
+            self._next = (self._next + 1) % self.POOL_SIZE
+            out = self._outputs[self._next]
+        self._next = (self._next + 1) % self.POOL_SIZE
+        roi = src[self.roi]
+        if self.flip_source:
+            # 放大：先镜像较小的源区域
+            cv2.flip(roi, 1, dst=self._flip_buffer)
+            cv2.resize(self._flip_buffer, self.target_size, dst=out)
+        else:
+            cv2.resize(roi, self.target_size, dst=out)
+            if self.mirror:
+                # 缩小：在较小的输出上原地镜像
+                cv2.flip(out, 1, dst=out)
+        return out
+
+
+# ======================================================
+# 人脸集合：一个连续的 (N, 15) float32 数组
+# ======================================================
+class FaceSet:
+    """
+    一组检测结果，底层是一个连续的 (N, 15) float32 数组（与 YuNet 输出同一布局）。
+    过滤、坐标换算、裁剪、快照和随机选择都按整个数组向量化完成，人脸再多开销也基本不变。
+    """
+
+    __slots__ = ("data",)
+
+    COLUMNS = 15
+
+    def __init__(self, data=None):
+        if data is None:
+            data = np.empty((0, self.COLUMNS), np.float32)
+        self.data = np.ascontiguousarray(data, dtype=np.float32).reshape(-1, self.COLUMNS)
+
+    @classmethod
+    def from_detections(cls, detected):
+        """从 FaceDetectorYN.detect 的输出构造，过滤掉框坐标含 inf/nan 的行"""
+        if detected is None or len(detected) == 0:
+            return cls()
+        detected = np.asarray(detected, dtype=np.float32)
+        return cls(detected[np.isfinite(detected[:, :4]).all(axis=1)])
+
+    @classmethod
+    def from_boxes(cls, boxes):
+        """从检测后端的 (N, 5) 输出构造；没有关键点的后端关键点列为 NaN（光流跟踪会跳过）"""
+        if boxes is None or len(boxes) == 0:
+            return cls()
+        boxes = np.asarray(boxes, dtype=np.float32)
+        boxes = boxes[np.isfinite(boxes[:, :4]).all(axis=1)]
+        data = np.full((len(boxes), cls.COLUMNS), np.nan, np.float32)
+        data[:, :4] = boxes[:, :4]
+        data[:, 14] = boxes[:, 4]
+        return cls(data)
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    def __getitem__(self, index):
+        """整数下标返回一行，切片、布尔或整数数组返回新的 FaceSet"""
+        if isinstance(index, (int, np.integer)):
+            return self.data[index]
+        return FaceSet(self.data[index])
+
+    def copy(self):
+        return FaceSet(self.data.copy())
+
+    def mapped(self, scale, x_off=0, y_off=0):
+        """框和关键点按缩放与平移换算到另一坐标系，置信度不变"""
+        data = self.data.copy()
+        data[:, :14] *= scale
+        data[:, FACE_X_COLS] -= x_off
+        data[:, FACE_Y_COLS] -= y_off
+        return FaceSet(data)
+
+    def translated(self, dx, dy):
+        """每张脸按各自的位移平移（dx、dy 为长度 N 的数组）"""
+        data = self.data.copy()
+        data[:, FACE_X_COLS] += np.asarray(dx, np.float32)[:, None]
+        data[:, FACE_Y_COLS] += np.asarray(dy, np.float32)[:, None]
+        return FaceSet(data)
+
+    def centers(self):
+        return self.data[:, 0:2] + self.data[:, 2:4] / 2
+
+    def visible_in(self, img_w, img_h):
+        """只保留中心落在画面内的人脸"""
+        c = self.centers()
+        mask = (c[:, 0] >= 0) & (c[:, 0] < img_w) & (c[:, 1] >= 0) & (c[:, 1] < img_h)
+        return self[mask]
+
+    def valid_mask(self, img_w, img_h):
+        """坐标有限且在合理范围内的行"""
+        x, y, w, h = self.data[:, 0], self.data[:, 1], self.data[:, 2], self.data[:, 3]
+        with np.errstate(invalid="ignore"):
+            return (
+                np.isfinite(self.data[:, :4]).all(axis=1)
+                & (x >= -img_w) & (x <= img_w * 2)
+                & (y >= -img_h) & (y <= img_h * 2)
+                & (w > 0) & (h > 0) & (w <= img_w * 2) & (h <= img_h * 2)
+            )
+
+    def clipped_boxes(self, img_w, img_h):
+        """有效行的整数框 (M, 4)：x, y, w, h，已裁剪到画面范围内"""
+        boxes = self.data[self.valid_mask(img_w, img_h), :4].astype(np.int32)
+        x = np.clip(boxes[:, 0], 0, img_w - 1)
+        y = np.clip(boxes[:, 1], 0, img_h - 1)
+        w = np.clip(boxes[:, 2], 1, np.maximum(1, img_w - x))
+        h = np.clip(boxes[:, 3], 1, np.maximum(1, img_h - y))
+        return np.stack([x, y, w, h], axis=1)
+
+    def suppressed(self, iou_threshold=0.3, containment=0.7):
+        """
+        非极大值抑制：按置信度从高到低保留，去掉与已保留框 IoU 超过阈值，
+        或者大部分面积落在已保留框内（分块边缘截断的半张脸）的框。
+        """
+        if len(self) < 2:
+            return self.copy()
+        x1, y1 = self.data[:, 0], self.data[:, 1]
+        x2, y2 = x1 + self.data[:, 2], y1 + self.data[:, 3]
+        areas = self.data[:, 2] * self.data[:, 3]
+        order = np.argsort(-self.data[:, 14])
+        keep = []
+        while order.size:
+            i, rest = order[0], order[1:]
+            keep.append(i)
+            inter = (
+                np.clip(np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]), 0, None)
+                * np.clip(np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]), 0, None)
+            )
+            iou = inter / (areas[i] + areas[rest] - inter)
+            covered = inter / np.minimum(areas[i], areas[rest])
+            order = rest[(iou <= iou_threshold) & (covered <= containment)]
+        return self[np.array(keep)]
+
+    def random_index(self):
+        """随机选一张脸的下标，没有人脸时返回 -1"""
+        return random.randrange(len(self)) if len(self) else -1
+
+    def draw(self, img, color, thickness=2):
+        """绘制人脸框；无效坐标的过滤和裁剪对整个数组一次完成"""
+        img_h, img_w = img.shape[:2]
+        for x, y, w, h in self.clipped_boxes(img_w, img_h).tolist():
+            cv2.rectangle(img, (x, y), (x + w, y + h), color, thickness)
+
+
+# ======================================================
+# 显示缓冲区
+# ======================================================
+# 人脸框颜色 (B, G, R, A)：显示缓冲区是 BGRA，三元素颜色会把 alpha 写成 0
+FACE_COLOR = (0, 255, 0, 255)
+SELECTED_COLOR = (0, 0, 255, 255)
+
+
+class DisplayBuffer:
+    """
+    显示用的复用缓冲区：BGR 画面写入按尺寸复用的 BGRA 缓冲区，以 Format_RGB32 交给 Qt。
+    RGB32 在（小端）内存中就是 B,G,R,A 字节序，也是 QPixmap 的原生格式，
+    fromImage 和绘制时都不再做格式转换；QImage 只在尺寸变化时重新创建。
+    """
+
+    def __init__(self):
+        self.buffer = None
+        self.image = None
+
+    def load(self, img):
+        """把 BGR 画面写入缓冲区，返回可以继续绘制的 BGRA 缓冲区"""
+        h, w = img.shape[:2]
+        if self.buffer is None or self.buffer.shape[:2] != (h, w):
+            self.buffer = np.empty((h, w, 4), np.uint8)
+            self.image = QImage(self.buffer.data, w, h, w * 4, QImage.Format_RGB32)
+        cv2.cvtColor(img, cv2.COLOR_BGR2BGRA, dst=self.buffer)
+        return self.buffer
+
+    def to_pixmap(self):
+        return QPixmap.fromImage(self.image)
+
+
+# ======================================================
+# 光流跟踪：两次 YuNet 检测之间传播人脸框
+# ======================================================
+def group_median(values, groups, n_groups):
+    """按组求中位数（向量化）；空组结果为 0"""
+    result = np.zeros(n_groups, np.float32)
+    if len(values) == 0:
+        return result
+    order = np.lexsort((values, groups))
+    sorted_values = values[order]
+    sorted_groups = groups[order]
+    starts = np.searchsorted(sorted_groups, np.arange(n_groups))
+    counts = np.bincount(groups, minlength=n_groups)
+    present = counts > 0
+    lower = starts[present] + (counts[present] - 1) // 2
+    upper = starts[present] + counts[present] // 2
+    result[present] = (sorted_values[lower] + sorted_values[upper]) / 2
+    return result
+
+
+class FaceTracker:
+    """用金字塔 LK 光流在两次完整检测之间移动人脸框，跟踪质量下降时要求重新检测"""
+
+    def __init__(self, points_per_face=8, min_points=3, min_quality=0.7, max_fb_error=1.0):
+        self.lk_params = dict(
+            winSize=(21, 21),
+            maxLevel=3,
+            criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03),
+        )
+        self.points_per_face = points_per_face  # 每张脸额外取的角点数（另有5个关键点）
+        self.min_points = min_points  # 每张脸至少要有几个点跟踪成功
+        self.min_quality = min_quality  # 跟踪成功的人脸比例低于此值时重新检测
+        self.max_fb_error = max_fb_error  # 前后向光流误差上限（像素）
+        self.clear()
+
+    @property
+    def active(self):
+        return self._prev_gray is not None
+
+    def clear(self):
+        self._prev_gray = None
+        self._points = None  # (M, 1, 2) float32
+        self._owners = None  # 每个点所属的人脸下标
+        self._faces = FaceSet()
+
+    def reset(self, gray, faces):
+        """用一次完整检测的结果重新选取特征点"""
+        img_h, img_w = gray.shape[:2]
+        n = len(faces)
+        # YuNet 的5个关键点本身就是很好的跟踪点；没有关键点的检测后端这几列为 NaN，跳过
+        keypoints = faces.data[:, 4:14].reshape(-1, 2)
+        finite = np.isfinite(keypoints).all(axis=1)
+        points = [keypoints[finite]]
+        owners = [np.repeat(np.arange(n), 5)[finite]]
+
+        # 再在每个框内补充一些角点
+        if self.points_per_face > 0:
+            boxes = faces.clipped_boxes(img_w, img_h) if n else np.empty((0, 4), np.int32)
+            for i, (x, y, w, h) in enumerate(boxes):
+                if w < 8 or h < 8:
+                    continue
+                corners = cv2.goodFeaturesToTrack(
+                    gray[y:y + h, x:x + w], self.points_per_face, 0.01, max(2, int(w) // 8)
+                )
+                if corners is not None:
+                    points.append(corners.reshape(-1, 2) + (x, y))
+                    owners.append(np.full(len(corners), i))
+
+        self._prev_gray = gray
+        self._faces = faces.copy()
+        self._points = np.concatenate(points).astype(np.float32).reshape(-1, 1, 2)
+        self._owners = np.concatenate(owners).astype(np.intp)
+
+    def track(self, gray):
+        """
+        把上一帧的人脸框传播到当前帧。
+        跟踪质量不足时返回 None，调用方应重新做完整检测。
+        """
+        if not self.active or gray.shape != self._prev_gray.shape:
+            return None
+        if not len(self._faces):
+            self._prev_gray = gray
+            return FaceSet()
+
+        p0 = self._points
+        p1, st1, _ = cv2.calcOpticalFlowPyrLK(self._prev_gray, gray, p0, None, **self.lk_params)
+        p0r, st2, _ = cv2.calcOpticalFlowPyrLK(gray, self._prev_gray, p1, None, **self.lk_params)
+
+        # 前后向一致性检查
+        fb_error = np.linalg.norm((p0 - p0r).reshape(-1, 2), axis=1)
+        good = (st1.ravel() == 1) & (st2.ravel() == 1) & (fb_error < self.max_fb_error)
+
+        motion = (p1 - p0).reshape(-1, 2)
+        counts = np.bincount(self._owners[good], minlength=len(self._faces))
+        tracked = counts >= self.min_points
+        if tracked.mean() < self.min_quality:
+            return None
+
+        # 每张脸取成功点位移的中位数
+        dx = group_median(motion[good, 0], self._owners[good], len(self._faces))
+        dy = group_median(motion[good, 1], self._owners[good], len(self._faces))
+        faces = self._faces.translated(dx, dy)[tracked]
+
+        # 只保留仍在跟踪的人脸和成功的点
+        keep = good & tracked[self._owners]
+        remap = np.cumsum(tracked) - 1
+        self._points = p1[keep]
+        self._owners = remap[self._owners[keep]]
+        self._faces = faces
+        self._prev_gray = gray
+        return faces
+
+
+# ======================================================
+# 分块检测：后排的小人脸在原始分辨率的重叠分块上检测
+# ======================================================
+def tile_positions(length, tile, overlap):
+    """一个方向上的分块起点，最后一块与边缘对齐，所有分块尺寸相同"""
+    if length <= tile:
+        return [0]
+    step = max(1, tile - overlap)
+    positions = list(range(0, length - tile, step))
+    positions.append(length - tile)
+    return positions
+
+
+class TiledDetector:
+    """
+    与 FaceDetectorYN 接口一致（setInputSize / setScoreThreshold / detect），DetectStage 不需要区分。
+
+    把原始分辨率的画面切成互相重叠的 tile_size 方块，在线程池中并发检测，
+    每个工作线程有自己的 YuNet 实例；另外在整幅缩小到 coarse_width 的画面上检测一次，
+    负责比分块还大的近处人脸。所有结果换算回原图坐标后统一做非极大值抑制。
+    overlap 应不小于需要完整检出的最大人脸尺寸（像素）：贴着分块内侧边缘的框
+    （被切开的人脸或半个物体）直接丢弃，由相邻分块中完整的那一份负责。
+    """
+
+    EDGE_MARGIN = 2  # 距分块内侧边缘多少像素以内算作被切开
+
+    def __init__(self, model, tile_size=640, overlap=128, workers=None, coarse_width=640,
+                 score_threshold=0.6, nms_threshold=0.3):
+        self.model = model
+        self.tile_size = tile_size
+        self.overlap = min(overlap, tile_size // 2)
+        self.coarse_width = coarse_width
+        self.score_threshold = score_threshold
+        self.nms_threshold = nms_threshold
+        self.workers = workers or os.cpu_count() or 1
+        self.tiles = []
+        self.frame_size = None
+        self.coarse_size = None
+        self._local = threading.local()
+        self._threshold_version = 0
+        # 先在加载线程中创建一个实例，模型有问题时在这里报错；它交给第一个工作线程使用
+        self._spare = [create_detector(model, (tile_size, tile_size), score_threshold)]
+        self._spare_lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="yunet-tile")
+
+    def setInputSize(self, size):
+        frame_w, frame_h = size
+        self.frame_size = (frame_w, frame_h)
+        tile_w, tile_h = min(self.tile_size, frame_w), min(self.tile_size, frame_h)
+        self.tiles = [
+            (x, y, tile_w, tile_h)
+            for y in tile_positions(frame_h, self.tile_size, self.overlap)
+            for x in tile_positions(frame_w, self.tile_size, self.overlap)
+        ]
+        # 只有一块时它已经覆盖整幅画面，不需要额外的全图检测
+        if len(self.tiles) > 1 and self.coarse_width:
+            coarse_w = min(self.coarse_width, frame_w)
+            self.coarse_size = (coarse_w, max(1, round(frame_h * coarse_w / frame_w)))
+        else:
+            self.coarse_size = None
+
+    def setScoreThreshold(self, threshold):
+        # 各工作线程在下次检测前自己更新
+        self.score_threshold = threshold
+        self._threshold_version += 1
+
+    def _worker_detector(self, size):
+        local = self._local
+        if getattr(local, "detector", None) is None:
+            with self._spare_lock:
+                local.detector = self._spare.pop() if self._spare else None
+            if local.detector is None:
+                local.detector = create_detector(self.model, size, self.score_threshold)
+            local.size = None
+            local.version = -1
+        if local.size != size:
+            local.detector.setInputSize(size)
+            local.size = size
+        if local.version != self._threshold_version:
+            local.detector.setScoreThreshold(self.score_threshold)
+            local.version = self._threshold_version
+        return local.detector
+
+    def _detect_tile(self, img, x, y, w, h):
+        detector = self._worker_detector((w, h))
+        _, detected = detector.detect(img[y:y + h, x:x + w])
+        faces = FaceSet.from_detections(detected)
+        if len(faces) == 0:
+            return faces
+
+        # 丢弃贴着内侧边缘的框（画面外边缘不算）
+        frame_w, frame_h = self.frame_size
+        m = self.EDGE_MARGIN
+        bx, by, bw, bh = faces.data[:, 0], faces.data[:, 1], faces.data[:, 2], faces.data[:, 3]
+        cut = np.zeros(len(faces), bool)
+        if x > 0:
+            cut |= bx <= m
+        if y > 0:
+            cut |= by <= m
+        if x + w < frame_w:
+            cut |= bx + bw >= w - m
+        if y + h < frame_h:
+            cut |= by + bh >= h - m
+        faces = faces[~cut]
+        if len(faces) and (x or y):
+            faces.data[:, FACE_X_COLS] += x
+            faces.data[:, FACE_Y_COLS] += y
+        return faces
+
+    def _detect_coarse(self, img):
+        frame_w = img.shape[1]
+        small = cv2.resize(img, self.coarse_size, interpolation=cv2.INTER_AREA)
+        detector = self._worker_detector(self.coarse_size)
+        _, detected = detector.detect(small)
+        return FaceSet.from_detections(detected).mapped(frame_w / self.coarse_size[0])
+
+    def detect(self, img):
+        jobs = [self._pool.submit(self._detect_tile, img, *tile) for tile in self.tiles]
+        if self.coarse_size is not None:
+            jobs.append(self._pool.submit(self._detect_coarse, img))
+        parts = [job.result() for job in jobs]
+        data = np.concatenate([part.data for part in parts])
+        if len(data) == 0:
+            return 1, None
+        return 1, FaceSet(data).suppressed(self.nms_threshold).data
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+# ======================================================
+# 检测后端：YuNet / MediaPipe（cvzone）/ Haar 统一成同一个接口
+# ======================================================
+class DetectorBackend:
+    """
+    人脸检测后端的统一接口，检测流水线、模型预热和 benchmark.py 只依赖这几个方法：
+      set_input_size((w, h))   之后 detect 收到的图像尺寸
+      set_score_threshold(t)   置信度阈值
+      detect(img)              返回 (N, 5) float32 数组，每行 x, y, w, h, score（输入图像像素坐标），没有人脸时 N 为 0
+      detect_rows(img)         返回 FaceSet 布局的 (N, 15) 数组（框、5 个关键点、置信度），
+                               没有关键点的后端关键点为 NaN；流水线用它给光流跟踪提供关键点
+      close()                  释放线程池、连接等资源
+    子类实现 detect 和 detect_rows 中的一个即可，另一个由基类换算。
+    """
+
+    name = ""
+    BOX_COLUMNS = [0, 1, 2, 3, 14]  # (N, 15) 行中的框和置信度列
+
+    def set_input_size(self, size):
+        pass
+
+    def set_score_threshold(self, threshold):
+        pass
+
+    def detect(self, img):
+        return np.ascontiguousarray(self.detect_rows(img)[:, self.BOX_COLUMNS])
+
+    def detect_rows(self, img):
+        return FaceSet.from_boxes(self.detect(img)).data
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def empty():
+        return np.empty((0, 5), np.float32)
+
+
+class YuNetBackend(DetectorBackend):
+    """YuNet：包装 FaceDetectorYN 或接口相同的 TiledDetector，输出带关键点的完整行"""
+
+    name = "yunet"
+
+    def __init__(self, model=None, tiling=None, score_threshold=0.6, detector=None):
+        if detector is None:
+            model = default_model_path() if model is None else model
+            if tiling is not None:
+                detector = TiledDetector(model, score_threshold=score_threshold, **tiling)
+            else:
+                detector = create_detector(model, score_threshold=score_threshold)
+        self.detector = detector
+
+    def set_input_size(self, size):
+        self.detector.setInputSize(size)
+
+    def set_score_threshold(self, threshold):
+        self.detector.setScoreThreshold(threshold)
+
+    def detect_rows(self, img):
+        _, detected = self.detector.detect(img)
+        return FaceSet.from_detections(detected).data
+
+    def close(self):
+        if isinstance(self.detector, TiledDetector):
+            self.detector.close()
+
+
+class MediaPipeBackend(DetectorBackend):
+    """MediaPipe（通过 cvzone，与 3-control.py 相同），model_selection 0 为近距离模型、1 为远距离模型"""
+
+    name = "mediapipe"
+
+    def __init__(self, model_selection=1, score_threshold=0.6):
+        from cvzone.FaceDetectionModule import FaceDetector
+        self.detector = FaceDetector(minDetectionCon=score_threshold, modelSelection=model_selection)
+
+    def set_score_threshold(self, threshold):
+        # cvzone 在 findFaces 里按 minDetectionCon 过滤，可以随时修改
+        self.detector.minDetectionCon = threshold
+
+    def detect(self, img):
+        _, faces = self.detector.findFaces(img, draw=False)
+        if not faces:
+            return self.empty()
+        return np.array([[*face["bbox"], face["score"][0]] for face in faces], np.float32)
+
+
+class HaarBackend(DetectorBackend):
+    """
+    Haar 级联（与 2.py 相同的参数）。级联没有概率意义的置信度，score 为 detectMultiScale3 给出的
+    levelWeight，置信度阈值对它不起作用。
+    """
+
+    name = "haar"
+    CASCADE_FILE = "haarcascade_frontalface_default.xml"
+
+    def __init__(self, cascade_path=None, score_threshold=0.6, min_size=(40, 40)):
+        if not hasattr(cv2, "CascadeClassifier"):
+            raise RuntimeError(f"OpenCV {cv2.__version__} 不包含 CascadeClassifier，无法使用 Haar 检测")
+        if cascade_path is None:
+            data_dir = getattr(getattr(cv2, "data", None), "haarcascades", "")
+            cascade_path = os.path.join(data_dir, self.CASCADE_FILE)
+        self.cascade = cv2.CascadeClassifier(cascade_path)
+        if self.cascade.empty():
+            raise RuntimeError(f"无法加载 Haar 级联文件: {cascade_path}")
+        self.min_size = min_size
+
+    def detect(self, img):
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        rects, _, weights = self.cascade.detectMultiScale3(
+            gray,
+            scaleFactor=1.05,
+            minNeighbors=6,
+            minSize=self.min_size,
+            flags=cv2.CASCADE_SCALE_IMAGE,
+            outputRejectLevels=True
+        )
+        if len(rects) == 0:
+            return self.empty()
+        boxes = np.empty((len(rects), 5), np.float32)
+        boxes[:, :4] = rects
+        boxes[:, 4] = np.asarray(weights, np.float32).reshape(-1)
+        return boxes
+
+
+# 名称 -> 后端类，--detector 和 benchmark.py --backends 按名称选择
+DETECTOR_BACKENDS = {
+    YuNetBackend.name: YuNetBackend,
+    MediaPipeBackend.name: MediaPipeBackend,
+    HaarBackend.name: HaarBackend,
+}
+
+
+def create_backend(name, **options):
+    """按名称创建检测后端，options 传给对应后端的构造函数"""
+    backend = DETECTOR_BACKENDS.get(name)
+    if backend is None:
+        raise ValueError(f"未知的检测后端: {name}（可选 {', '.join(DETECTOR_BACKENDS)}）")
+    return backend(**options)
+
+
+# ======================================================
+# 流水线：有界队列与各阶段工作线程
+# ======================================================
+class DropOldestQueue:
+    """有界队列：满了就丢弃最旧的元素，消费者拿到的总是最新数据"""
+
+    def __init__(self, maxsize=1):
+        self._items = deque(maxlen=maxsize)
+        self._cond = threading.Condition()
+        self._closed = False
+        self.dropped = 0
+
+    def put(self, item):
+        with self._cond:
+            if len(self._items) == self._items.maxlen:
+                self.dropped += 1
+            self._items.append(item)
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """取出最旧的元素；超时或队列已关闭时返回 None"""
+        with self._cond:
+            if not self._items and not self._closed:
+                self._cond.wait(timeout)
+            return self._items.popleft() if self._items else None
+
+    def get_nowait(self):
+        with self._cond:
+            return self._items.popleft() if self._items else None
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class PipelineStage(QThread):
+    """流水线阶段基类：从输入队列取帧并处理，直到 stop()"""
+
+    def __init__(self, app, in_queue):
+        super().__init__()
+        self.app = app
+        self.in_queue = in_queue
+        self._running = False
+
+    def run(self):
+        self._running = True
+        while self._running:
+            frame = self.in_queue.get(timeout=0.1)
+            if frame is None:
+                continue
+            try:
+                self.process(frame)
+            except Exception as e:
+                print(f"{type(self).__name__} 处理出错: {e}")
+
+    def process(self, frame):
+        raise NotImplementedError
+
+    def stop(self):
+        self._running = False
+        self.in_queue.close()
+        self.wait()
+
+
+class DetectStage(PipelineStage):
+    """
+    预处理 + 人脸检测：以 YuNet 能承受的速率运行，只发布最新检测结果。
+    detect_interval > 1 时每 N 帧做一次完整检测，中间帧用光流传播人脸框。
+    """
+
+    def __init__(self, app, in_queue):
+        super().__init__(app, in_queue)
+        self.detector = None
+        self._pending_threshold = None
+        self._lock = threading.Lock()
+        self._input_size = None
+        self._faces = FaceSet()  # 最新检测结果，坐标为镜像后的摄像头原始画面坐标
+
+        self.tracker = FaceTracker()
+        self._frames_since_detect = 0
+        self.detector_calls = 0
+        self.tracked_frames = 0
+
+    def set_detector(self, detector):
+        self.detector = detector
+
+    def set_score_threshold(self, threshold):
+        # 在检测线程中应用，避免与 detect() 并发修改检测器
+        self._pending_threshold = threshold
+
+    def latest_faces(self):
+        """返回最新检测结果（摄像头原始画面坐标）"""
+        with self._lock:
+            return self._faces
+
+    def process(self, frame):
+        app = self.app
+        detector = self.detector
+        if detector is None or app.state != "normal" or app.is_static_mode:
+            # 暂停期间画面不连续，恢复后从完整检测开始
+            self.tracker.clear()
+            return
+
+        if self._pending_threshold is not None:
+            detector.set_score_threshold(self._pending_threshold)
+            self._pending_threshold = None
+            self.tracker.clear()
+
+        perf = app.perf
+        start = time.perf_counter() if perf else 0.0
+
+        # 在摄像头原始画面（或按档位限制的分辨率）上检测，与窗口大小无关
+        frame_w = frame.shape[1]
+        img = detection_input(frame, app.detection_max_width)
+        det_h, det_w = img.shape[:2]
+
+        # 检测尺寸只在档位变化时重新设置
+        if self._input_size != (det_w, det_h):
+            detector.set_input_size((det_w, det_h))
+            self._input_size = (det_w, det_h)
+            self.tracker.clear()
+
+        # 两次完整检测之间先尝试光流跟踪，质量不够时自动重新检测
+        interval = app.detect_interval
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if interval > 1 else None
+        faces = None
+        stage = "track"
+        if gray is not None and self._frames_since_detect < interval:
+            faces = self.tracker.track(gray)
+            if faces is not None:
+                self.tracked_frames += 1
+        if faces is None:
+            stage = "detect"
+            faces = self.detect_faces(detector, img)
+            self._frames_since_detect = 0
+            if gray is not None:
+                self.tracker.reset(gray, faces)
+        self._frames_since_detect += 1
+        if perf:
+            perf.record(stage, start)
+
+        # 换算回摄像头原始画面坐标
+        if det_w != frame_w:
+            faces = faces.mapped(frame_w / det_w)
+
+        with self._lock:
+            self._faces = faces
+
+    def detect_faces(self, detector, img):
+        """完整检测（检测后端见 DetectorBackend）"""
+        self.detector_calls += 1
+        try:
+            rows = detector.detect_rows(img)
+
+            # 过滤无效的检测结果
+            return FaceSet.from_detections(rows)
+        except Exception as e:
+            print(f"人脸检测出错: {e}")
+            return FaceSet()
+
+
+class ComposeStage(PipelineStage):
+    """
+    合成：按摄像头帧率生成显示画面，并叠加最新的检测结果。
+    每合成一帧发出 frame_ready，界面随新帧到达刷新；界面还没处理上一次通知时不重复发送。
+    """
+
+    frame_ready = Signal()
+
+    def __init__(self, app, in_queue, detect_stage, out_queue):
+        super().__init__(app, in_queue)
+        self.detect_stage = detect_stage
+        self.out_queue = out_queue
+        self._notify_pending = threading.Event()
+
+    def acknowledge(self):
+        """界面开始处理通知时调用"""
+        self._notify_pending.clear()
+
+    def process(self, frame):
+        app = self.app
+        if app.is_static_mode or (app.state == "random" and app.static_frame is not None):
+            return
+
+        # resize_cover方法，保持视野大小；镜像、缩放、裁剪一起完成，同时把帧从环形缓冲区复制出来。
+        # 界面正在显示的画面所在的缓冲区不会被覆盖，随机时可以直接冻结它
+        target_w, target_h = app.display_size
+        frame_h, frame_w = frame.shape[:2]
+        perf = app.perf
+        start = time.perf_counter() if perf else 0.0
+        img = app.resize_cover(frame, target_w, target_h, mirror=True, avoid=app.presented_frame)
+        if perf:
+            perf.record("resize", start)
+
+        faces = FaceSet()
+        if app.state == "normal":
+            # 检测结果换算到显示坐标，只保留中心落在画面内的人脸
+            scale, x_off, y_off = cover_transform(frame_w, frame_h, target_w, target_h)
+            faces = self.detect_stage.latest_faces().mapped(scale, x_off, y_off).visible_in(target_w, target_h)
+
+        # 画面保持干净，人脸框在显示时绘制；画面与检测结果作为一个整体交给界面
+        self.out_queue.put((img, faces))
+        if not self._notify_pending.is_set():
+            self._notify_pending.set()
+            self.frame_ready.emit()
+
+
+# ======================================================
+# 常驻服务
+# ======================================================
+# 老师一节课里会多次关闭、重新打开程序。常驻服务（python 3-7.py --serve）在后台保持
+# 预热好的 YuNet 检测器，加 --serve-camera 时还保持摄像头常开；主程序启动时先尝试连接，
+# 连接上就直接使用，省掉模型加载、预热和摄像头协商。没有服务时行为与原来相同。
+#
+# 通信使用 multiprocessing.connection 的本地连接（Windows 命名管道 / Unix 套接字），
+# 用服务启动时生成的随机密钥认证。画面和检测各占一条连接，互不阻塞；
+# 图像数据用 send_bytes / recv_bytes_into 按一维字节视图收发，直接写入接收方的缓冲区。
+SERVICE_KEY_PATH = os.path.join(os.path.expanduser("~"), ".face_random", "service.key")
+SERVICE_TIMEOUT = 2.0  # 等待服务应答的时间（秒），超时视为服务不可用
+
+
+def service_address():
+    """常驻服务的本地地址：Windows 用命名管道，其他系统用用户目录下的 Unix 套接字"""
+    if sys.platform == "win32":
+        return r"\\.\pipe\face_random_" + getpass.getuser()
+    return os.path.join(os.path.expanduser("~"), ".face_random", "service.sock")
+
+
+def connect_service(kind, address=None, key_path=SERVICE_KEY_PATH):
+    """
+    连接常驻服务并完成握手，返回 (连接, 服务端信息)。
+    kind 为 "camera" 或 "detector"；服务没有运行或不提供该功能时返回 None。
+    """
+    from multiprocessing.connection import Client, AuthenticationError
+
+    try:
+        with open(key_path, "rb") as f:
+            authkey = f.read()
+    except OSError:
+        return None
+    address = address or service_address()
+    if sys.platform != "win32" and not os.path.exists(address):
+        return None
+    try:
+        conn = Client(address, authkey=authkey)
+        conn.send(("hello", kind))
+        info = conn.recv() if conn.poll(SERVICE_TIMEOUT) else None
+    except (OSError, EOFError, AuthenticationError):
+        return None
+    if info is None:
+        conn.close()
+        return None
+    return conn, info
+
+
+class ServiceSource(FrameSource):
+    """常驻服务的摄像头画面：服务一直开着摄像头，每次读取取走它的最新一帧"""
+
+    unpaced = False  # 服务端等到新画面才应答
+
+    def __init__(self, conn, info):
+        super().__init__(info["fps"])
+        self.conn = conn
+        self.width, self.height = info["size"]
+        self.seq = 0  # 已取到的帧序号，服务据此等待新画面
+        self.opened = True
+        self.on_disconnect = None  # 连接断开时调用一次（在采集线程中）
+
+    @classmethod
+    def connect(cls, address=None):
+        result = connect_service("camera", address)
+        return cls(*result) if result is not None else None
+
+    def isOpened(self):
+        return self.opened
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.width)
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.height)
+        return super().get(prop)
+
+    def release(self):
+        if self.opened:
+            self.opened = False
+            self.conn.close()
+
+    def read(self, image=None):
+        if not self.opened:
+            return False, None
+        try:
+            self.conn.send(("read", self.seq))
+            reply = self.conn.recv()
+            if reply is None:
+                return False, None
+            self.seq, shape = reply
+            if image is None or image.shape != shape or image.dtype != np.uint8:
+                image = np.empty(shape, np.uint8)
+            self.conn.recv_bytes_into(image.reshape(-1))
+        except (OSError, EOFError) as e:
+            print(f"常驻服务连接断开: {e}")
+            self.opened = False
+            if self.on_disconnect is not None:
+                self.on_disconnect()
+            return False, None
+        return True, image
+
+
+class ServiceDetector(DetectorBackend):
+    """常驻服务里预热好的 YuNet 检测器（检测后端接口见 DetectorBackend）"""
+
+    name = "yunet"
+
+    def __init__(self, conn, info):
+        self.conn = conn
+        self.score_threshold = info["score_threshold"]
+        self.closed = False
+        self.on_disconnect = None  # 连接断开时调用一次（在检测线程中）
+
+    @classmethod
+    def connect(cls, address=None):
+        result = connect_service("detector", address)
+        return cls(*result) if result is not None else None
+
+    def set_input_size(self, size):
+        # 服务端按收到的图像尺寸设置
+        pass
+
+    def set_score_threshold(self, threshold):
+        self.score_threshold = threshold
+
+    def detect_rows(self, img):
+        if self.closed:
+            return FaceSet().data
+        img = np.ascontiguousarray(img)
+        try:
+            self.conn.send(("detect", img.shape, self.score_threshold))
+            self.conn.send_bytes(img.reshape(-1))
+            return self.conn.recv()
+        except (OSError, EOFError) as e:
+            print(f"常驻服务连接断开，停止检测: {e}")
+            self.closed = True
+            if self.on_disconnect is not None:
+                self.on_disconnect()
+            return FaceSet().data
+
+    def close(self):
+        self.closed = True
+        self.conn.close()
+
+
+class WarmService:
+    """常驻服务本体：一个预热好的检测器，可选一个常开的画面来源"""
+
+    def __init__(self, model, source=None, warmup_sizes=()):
+        self.source = source
+        self.detector = YuNetBackend(model)
+        self.detect_lock = threading.Lock()
+        self.input_size = None
+        self.score_threshold = 0.6
+        for size in warmup_sizes:
+            warm_up_detector(self.detector, size)
+            self.input_size = size
+
+        # 最新画面：采集线程每帧新分配数组，发送中的画面不会被覆盖
+        self.frame_cond = threading.Condition()
+        self.frame = None
+        self.seq = 0
+        self.readers = 0  # 正在读取画面的客户端数，为 0 时只 grab 不解码
+        self.running = True
+        self.capture = None
+        if source is not None:
+            self.capture = threading.Thread(target=self.capture_loop, name="service-capture", daemon=True)
+            self.capture.start()
+
+    def capture_loop(self):
+        idle = hasattr(self.source, "grab")
+        while self.running:
+            if self.readers == 0 and idle:
+                if not self.source.grab():
+                    time.sleep(0.01)  # 摄像头拔出或出错时不空转
+                continue
+            ret, frame = self.source.read()
+            with self.frame_cond:
+                if ret and frame is not None:
+                    self.frame = frame
+                    self.seq += 1
+                self.frame_cond.notify_all()
+            if not ret:
+                time.sleep(0.01)
+
+    def handle(self, conn):
+        """处理一个客户端连接，直到对方断开"""
+        try:
+            request, kind = conn.recv()
+            if request != "hello":
+                return
+            if kind == "camera" and self.source is not None and self.source.isOpened():
+                w = int(self.source.get(cv2.CAP_PROP_FRAME_WIDTH))
+                h = int(self.source.get(cv2.CAP_PROP_FRAME_HEIGHT))
+                conn.send({"size": (w, h), "fps": self.source.get(cv2.CAP_PROP_FPS)})
+                with self.frame_cond:
+                    self.readers += 1
+                try:
+                    self.serve_frames(conn)
+                finally:
+                    with self.frame_cond:
+                        self.readers -= 1
+            elif kind == "detector":
+                conn.send({"score_threshold": self.score_threshold})
+                self.serve_detection(conn)
+            else:
+                conn.send(None)
+        except (OSError, EOFError):
+            pass  # 客户端退出
+        except Exception as e:
+            print(f"常驻服务处理请求出错: {type(e).__name__}: {e}")
+        finally:
+            conn.close()
+
+    def serve_frames(self, conn):
+        while True:
+            _, last_seq = conn.recv()
+            with self.frame_cond:
+                self.frame_cond.wait_for(lambda: self.seq != last_seq or not self.running, timeout=1.0)
+                frame, seq = self.frame, self.seq
+            if frame is None or seq == last_seq:
+                conn.send(None)
+                continue
+            conn.send((seq, frame.shape))
+            conn.send_bytes(np.ascontiguousarray(frame).reshape(-1))
+
+    def serve_detection(self, conn):
+        while True:
+            _, shape, threshold = conn.recv()
+            img = np.empty(shape, np.uint8)
+            conn.recv_bytes_into(img.reshape(-1))
+            size = (shape[1], shape[0])
+            with self.detect_lock:
+                if self.input_size != size:
+                    self.detector.set_input_size(size)
+                    self.input_size = size
+                if self.score_threshold != threshold:
+                    self.detector.set_score_threshold(threshold)
+                    self.score_threshold = threshold
+                rows = self.detector.detect_rows(img)
+            conn.send(rows)
+
+    def close(self):
+        self.running = False
+        if self.capture is not None:
+            self.capture.join(timeout=2.0)
+        if self.source is not None:
+            self.source.release()
+
+
+def write_service_key(path=SERVICE_KEY_PATH):
+    """生成本次服务的随机认证密钥，只有当前用户可读"""
+    key = os.urandom(32)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(key)
+    return key
+
+
+def run_service(source_spec=None, serve_camera=False, probe_camera=False, address=None):
+    """运行常驻服务直到 Ctrl+C"""
+    from multiprocessing.connection import Listener, AuthenticationError
+
+    import_heavy_modules()
+    address = address or service_address()
+    if connect_service("detector", address) is not None:
+        print("常驻服务已在运行")
+        return
+    if sys.platform != "win32" and os.path.exists(address):
+        os.remove(address)  # 上次异常退出留下的套接字文件
+
+    start = time.perf_counter()
+    model = load_embedded_model()
+    if model is None:
+        model = map_model_file(default_model_path())
+    source = None
+    warmup_sizes = [(1280, 720)]
+    if serve_camera:
+        source = open_frame_source(source_spec, probe_camera=probe_camera)
+        if source.isOpened():
+            w = int(source.get(cv2.CAP_PROP_FRAME_WIDTH))
+            h = int(source.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            warmup_sizes = [detection_size(w, h, 1280)]
+        else:
+            print(f"无法打开画面来源: {source_spec or 'camera'}，只提供检测")
+            source.release()
+            source = None
+    service = WarmService(model, source, warmup_sizes)
+
+    listener = Listener(address, authkey=write_service_key())
+    print(f"常驻服务已启动（{(time.perf_counter() - start) * 1000:.0f} ms），地址 {address}，按 Ctrl+C 退出")
+    try:
+        while True:
+            try:
+                conn = listener.accept()
+            except (OSError, EOFError, AuthenticationError) as e:
+                print(f"拒绝连接: {e}")
+                continue
+            threading.Thread(target=service.handle, args=(conn,), daemon=True).start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.close()
+        service.close()
+        print("常驻服务已退出")
+
+
 # ======================================================
 # 主窗口
 # ======================================================
 class FaceRandomApp(QWidget):
-    def __init__(self):
+    service_lost = Signal(str)  # 常驻服务连接断开："camera" 或 "detector"，在界面线程中处理
+
+    def __init__(self, source=None, source_fps=None, probe_camera=False, reduced_decode=False, tiling=None,
+                 use_service=True, backend="yunet", detect_interval=5, detect_width=1280):
         super().__init__()
+        # 画面来源描述，见 open_frame_source；None 表示摄像头
+        self.source_spec = source
+        self.source_fps = source_fps
+        self.probe_camera = probe_camera
+        self.reduced_decode = reduced_decode
+        self.tiling = tiling
+        # 有常驻服务（--serve）时使用它预热好的检测器；默认摄像头来源时还使用它开着的摄像头
+        self.use_service = use_service
+        self.backend = backend  # 检测后端名称，见 DETECTOR_BACKENDS；分块检测和常驻服务只用于 YuNet
+        # 每隔几帧做一次完整检测，中间帧用光流跟踪；设为1表示每帧都检测
+        self.detect_interval = max(1, detect_interval)
+        # 检测分辨率上限（宽度），超过时降到 DETECTION_WIDTHS 中的档位；None 或 0 表示始终用摄像头原始分辨率
+        self.detection_max_width = detect_width or None
+        if backend != YuNetBackend.name and tiling is not None:
+            print("分块检测只支持 YuNet，已忽略 --tiles")
+            self.tiling = None
 
         # 先显示加载页面
         self.loading_screen = LoadingScreen()
@@ -109,8 +2121,31 @@ class FaceRandomApp(QWidget):
         # 强制立即处理GUI事件，确保加载页面能立即显示
         QApplication.processEvents()
 
-        # 延迟初始化主界面
-        QTimer.singleShot(100, self.initialize_app)
+        # cv2 和 numpy 在后台导入，完成后再初始化主界面
+        self.import_loader = ImportLoader()
+        self.import_loader.progress.connect(self.on_loading_progress)
+        self.import_loader.imported.connect(self.on_modules_imported)
+        self.import_loader.start()
+
+    def on_modules_imported(self, error):
+        self.import_loader.wait()
+        if error:
+            print(f"运行库加载失败: {error}")
+            self.abort_startup("运行库加载失败")
+            return
+        print("导入耗时: " + ", ".join(f"{name} {ms:.0f} ms" for name, ms in IMPORT_TIMINGS.items()))
+        self.initialize_app()
+
+    def abort_startup(self, message, delay=3000):
+        """启动失败：在加载界面上显示原因，稍后关闭并以非零状态退出（加载界面无边框，用户无法自行关闭）"""
+        self.loading_screen.loading_label.setText(message)
+        self.loading_screen.progress_bar.hide()
+
+        def quit_app():
+            self.loading_screen.close()
+            QApplication.exit(1)
+
+        QTimer.singleShot(delay, quit_app)
 
     def initialize_app(self):
         """初始化应用程序"""
@@ -118,68 +2153,220 @@ class FaceRandomApp(QWidget):
         self.state = "normal"
         self.selected_face_index = -1
         self.static_frame = None
-        self.faces_snapshot = []
-        self.faces = []
+        self.faces_snapshot = FaceSet()
+        self.faces = FaceSet()
+        self.presented_frame = None  # 当前显示的画面（不含人脸框），与 self.faces 一一对应
+        self.frozen_pixmap = None  # 随机模式下合成好的冻结画面
         self.detection_confidence = 0.6
         self.is_static_mode = False
+        if self.tiling is not None:
+            # 分块检测在原始分辨率上进行，检测器内部自己做缩小的全图检测
+            self.detection_max_width = None
         self.last_black_frame = None  # 缓存黑屏帧
+        self.geometry_cache = {}  # (源尺寸, 目标尺寸, 是否镜像) -> CoverGeometry
+        self.display_buffer = DisplayBuffer()  # 显示用的复用缓冲区
+        # 性能统计：设置环境变量 FACE_RANDOM_PERF=1 启动时开启，运行中按 F12 开关浮层、F11 导出；
+        # 关闭时为 None，各阶段不计时
+        self.perf = PerfStats() if os.environ.get("FACE_RANDOM_PERF") else None
+        self.perf_dump_path = os.environ.get("FACE_RANDOM_PERF_DUMP")
 
-        # 初始化摄像头 - 保持常开
-        self.cap = cv2.VideoCapture(0)
-        if self.cap.isOpened():
-            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
-            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
-            self.cap.set(cv2.CAP_PROP_FPS, 30)
+        self.cap = None
+        self.detector = None
+        self.service_lost.connect(self.on_service_lost)
 
         # UI
         self.setup_ui()
 
-        # 启动模型加载
+        # 摄像头和模型同时在后台准备，两者都完成后再显示主窗口
+        self.loading_screen.loading_label.setText("正在启动...")
+        self.startup_pending = {"camera", "model"}
+        self.camera_loader = CameraLoader(self.source_spec, self.source_fps, self.probe_camera, self.reduced_decode,
+                                          use_service=self.use_service and self.source_spec is None)
+        self.camera_loader.progress.connect(self.on_camera_progress)
+        self.camera_loader.opened.connect(self.on_camera_opened)
+        self.camera_loader.start()
         self.start_model_loading()
 
+    def on_camera_progress(self, message):
+        self.loading_screen.set_status("摄像头", message)
+
+    def on_camera_opened(self, cap):
+        """画面来源打开后建立流水线（画面来源保持常开）"""
+        self.camera_loader.wait()
+        self.cap = cap
+        if isinstance(cap, ServiceSource):
+            cap.on_disconnect = lambda: self.service_lost.emit("camera")
+        if not self.cap.isOpened():
+            print(f"无法打开画面来源: {self.source_spec or 'camera'}")
+        self.update_required_capture_size()
+        if getattr(self, 'loader', None) is not None:
+            # 知道分辨率后模型才能按实际检测尺寸预热
+            self.loader.set_warmup_sizes(self.expected_detection_sizes())
+
+        # 流水线：采集 → 预处理与检测 → 合成，阶段之间用丢弃最旧帧的有界队列衔接；
+        # 界面线程只负责显示合成好的画面
+        self.present_queue = DropOldestQueue(1)
+        self.detect_stage = DetectStage(self, DropOldestQueue(1))
+        self.compose_stage = ComposeStage(self, DropOldestQueue(1), self.detect_stage, self.present_queue)
+        self.capture = CaptureThread(self.cap, outputs=(self.detect_stage.in_queue, self.compose_stage.in_queue))
+        self.capture.perf = self.perf
+        if self.perf is not None:
+            self.set_perf_enabled(True)
+        if self.detector is not None:
+            self.detect_stage.set_detector(self.detector)
+        if self.cap.isOpened():
+            self.detect_stage.start()
+            self.compose_stage.start()
+            self.capture.start()
+        self.finish_startup_task("camera")
+
     def start_model_loading(self):
-        """启动模型加载"""
-        model_path = self.get_yunet_model_path()
-        if model_path:
-            self.loader = ModelLoader(model_path)
+        """启动模型加载：先按预计的检测尺寸预热，摄像头打开后再补充实际尺寸"""
+        if self.backend != YuNetBackend.name:
+            # 其他检测后端自己负责模型文件
+            self.loader = ModelLoader(None, warmup_sizes=self.predicted_detection_sizes(), backend=self.backend)
             self.loader.loaded.connect(self.on_model_loaded)
-            self.loader.progress.connect(self.on_loading_progress)
+            self.loader.progress.connect(self.on_model_progress)
+            self.loader.start()
+            return
+
+        if self.use_service and self.tiling is None:
+            detector = ServiceDetector.connect()
+            if detector is not None:
+                detector.on_disconnect = lambda: self.service_lost.emit("detector")
+                self.loader = None
+                self.loading_screen.set_status("模型", "使用常驻服务")
+                self.on_model_loaded(detector, "")
+                return
+
+        model = self.load_yunet_model()
+        if model is not None:
+            self.loader = ModelLoader(model, self.tiling, warmup_sizes=self.predicted_detection_sizes())
+            self.loader.loaded.connect(self.on_model_loaded)
+            self.loader.progress.connect(self.on_model_progress)
             self.loader.start()
         else:
             # 如果没有模型，跳过模型加载
-            self.loading_screen.close()
-            self.show()
-            self.timer = QTimer()
-            self.timer.timeout.connect(self.update_frame)
-            self.timer.start(30)
+            self.loader = None
+            self.loading_screen.set_status("模型", "未找到")
+            self.finish_startup_task("model")
+
+    def finish_startup_task(self, task):
+        """摄像头、模型都准备好后关闭加载界面并显示主窗口"""
+        if task not in self.startup_pending:
+            # 主窗口显示后重新加载（常驻服务断开后改用本地运行）
+            return
+        self.startup_pending.discard(task)
+        if self.startup_pending:
+            return
+        self.loading_screen.close()
+        self.show()
+        self.start_presenting()
+        self.log_startup()
+
+    def predicted_detection_sizes(self):
+        """画面来源打开前推算检测输入尺寸：默认摄像头有协商缓存时按缓存的分辨率，否则按 1280x720"""
+        size = cached_camera_size() if self.source_spec is None else None
+        frame_w, frame_h = size or (1280, 720)
+        return [detection_size(frame_w, frame_h, self.detection_max_width)]
+
+    def expected_detection_sizes(self):
+        """按画面来源的分辨率和检测档位推算检测输入尺寸，用于模型预热"""
+        frame_w = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)) if self.cap.isOpened() else 0
+        frame_h = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)) if self.cap.isOpened() else 0
+        if frame_w <= 0 or frame_h <= 0:
+            return self.predicted_detection_sizes()
+        return [detection_size(frame_w, frame_h, self.detection_max_width)]
 
     def get_yunet_model_path(self):
         """获取模型路径"""
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        model_path = os.path.join(base_dir, "model", "face_detection_yunet_2023mar.onnx")
+        model_path = default_model_path()
         return model_path if os.path.exists(model_path) else None
 
+    def load_yunet_model(self):
+        """获取模型字节：优先使用打包进程序的模型，否则内存映射模型文件；都没有时返回 None"""
+        model = load_embedded_model()
+        if model is not None:
+            return model
+        model_path = self.get_yunet_model_path()
+        if model_path is None:
+            return None
+        try:
+            return map_model_file(model_path)
+        except (OSError, ValueError) as e:
+            print(f"模型文件读取失败: {e}")
+            return None
+
     def on_loading_progress(self, message):
         """加载进度更新"""
         self.loading_screen.loading_label.setText(message)
 
+    def on_model_progress(self, message):
+        self.loading_screen.set_status("模型", message)
+
     def on_model_loaded(self, detector, error):
         """模型加载完成回调"""
         if detector and not error:
             self.detector = detector
             # 更新置信度
-            self.detector.setScoreThreshold(self.detection_confidence)
+            self.detector.set_score_threshold(self.detection_confidence)
+            if hasattr(self, 'detect_stage'):
+                self.detect_stage.set_detector(detector)
+            if self.loader is not None:
+                timings = self.loader.timings
+                print("模型加载耗时: " + ", ".join(f"{name} {ms:.0f} ms" for name, ms in timings.items()))
         else:
             print(f"模型加载失败: {error}")
+        self.finish_startup_task("model")
 
-        # 关闭加载界面并显示主窗口
-        self.loading_screen.close()
-        self.show()
+    def on_service_lost(self, kind):
+        """常驻服务断开：改用本地摄像头或本地模型继续运行，窗口标题提示当前状态"""
+        self.setWindowTitle("Face Random Selector（常驻服务已断开，已改用本地运行）")
+        if kind == "detector" and isinstance(self.detector, ServiceDetector):
+            print("常驻服务断开，改为本地加载模型")
+            self.detector.close()
+            self.detector = None
+            self.detect_stage.set_detector(None)
+            self.use_service = False
+            self.start_model_loading()
+            if self.loader is not None:
+                self.loader.set_warmup_sizes(self.expected_detection_sizes())
+        elif kind == "camera" and isinstance(self.cap, ServiceSource):
+            print("常驻服务断开，改为本地打开摄像头")
+            self.camera_loader = CameraLoader(self.source_spec, self.source_fps, self.probe_camera,
+                                              self.reduced_decode)
+            self.camera_loader.opened.connect(self.on_local_camera_opened)
+            self.camera_loader.start()
+
+    def on_local_camera_opened(self, cap):
+        """本地摄像头打开后替换采集线程的画面来源，流水线其余部分不变"""
+        self.camera_loader.wait()
+        if not self.capture.isRunning():
+            # 打开期间窗口已关闭
+            cap.release()
+            return
+        if not cap.isOpened():
+            print(f"无法打开画面来源: {self.source_spec or 'camera'}")
+        old, self.cap = self.cap, cap
+        self.update_required_capture_size()
+        self.capture.set_source(cap)
+        old.release()
+
+    def log_startup(self):
+        """记录本次启动各阶段的耗时：模块导入、摄像头打开、模型加载与预热、主窗口显示"""
+        timings = {f"import {name}": ms for name, ms in IMPORT_TIMINGS.items()}
+        timings.update({f"camera {name}": ms for name, ms in self.camera_loader.timings.items()})
+        loader = getattr(self, 'loader', None)
+        if loader is not None:
+            timings.update({f"model {name}": ms for name, ms in loader.timings.items()})
+        timings["window shown"] = (time.perf_counter() - START_TIME) * 1000
+        record_startup(timings)
 
-        # 启动视频更新定时器
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.update_frame)
-        self.timer.start(30)
+    def start_presenting(self):
+        """开始显示：由新画面到达驱动刷新，不再使用固定间隔的定时器"""
+        self.compose_stage.frame_ready.connect(self.update_frame)
+        # 连接之前到达的画面已经发出过通知，这里主动取一次，同时清除通知标记
+        self.update_frame()
 
     # ======================================================
     # UI
@@ -192,6 +2379,14 @@ class FaceRandomApp(QWidget):
         self.video_label.setGeometry(0, 0, self.width(), self.height())
         self.video_label.setStyleSheet("background: black;")
 
+        # 拖动窗口时连续触发 resizeEvent，显示尺寸和几何缓存延迟到停止拖动后再更新
+        self.resize_debounce = QTimer(self)
+        self.resize_debounce.setSingleShot(True)
+        self.resize_debounce.setInterval(150)
+        self.resize_debounce.timeout.connect(self.apply_display_size)
+        # 显示尺寸，供工作线程读取（不在工作线程中访问控件）
+        self.display_size = (self.video_label.width(), self.video_label.height())
+
         # 随机按钮
         self.btn = QPushButton("随机", self)
         self.btn.setFixedSize(140, 55)
@@ -258,8 +2453,28 @@ class FaceRandomApp(QWidget):
             }
         """)
 
+        # 性能浮层（默认隐藏）
+        self.perf_label = QLabel(self)
+        self.perf_label.move(20, 60)
+        self.perf_label.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.perf_label.setStyleSheet("""
+            QLabel {
+                background-color: rgba(0, 0, 0, 160);
+                color: #7CFC00;
+                font-family: monospace;
+                font-size: 13px;
+                padding: 6px;
+                border-radius: 6px;
+            }
+        """)
+        self.perf_label.hide()
+        self.perf_timer = QTimer(self)
+        self.perf_timer.setInterval(500)
+        self.perf_timer.timeout.connect(self.update_perf_overlay)
+
     def resizeEvent(self, event):
         self.video_label.setGeometry(0, 0, self.width(), self.height())
+        self.resize_debounce.start()
         self.btn.move(20, self.height() - 75)
         if hasattr(self, 'static_btn'):
             self.static_btn.move(self.btn.x() + self.btn.width() + 20, self.height() - 75)
@@ -267,32 +2482,103 @@ class FaceRandomApp(QWidget):
         self.last_black_frame = None
         super().resizeEvent(event)
 
+    def apply_display_size(self):
+        """窗口大小稳定后更新显示尺寸，并清空 resize_cover 的几何缓存"""
+        self.display_size = (self.video_label.width(), self.video_label.height())
+        self.geometry_cache = {}
+        self.update_required_capture_size()
+
+        # 没有新帧驱动刷新的画面，按新尺寸重新生成一次
+        self.frozen_pixmap = None
+        if self.is_static_mode:
+            self.show_static_black_screen()
+        elif self.state == "random" and self.static_frame is not None:
+            self.show_random_frame()
+
+    # ======================================================
+    # 性能统计
+    # ======================================================
+    def keyPressEvent(self, event):
+        if event.key() == Qt.Key_F12:
+            self.set_perf_enabled(self.perf is None)
+        elif event.key() == Qt.Key_F11 and self.perf is not None:
+            self.dump_perf(self.perf_dump_path or f"face_random_perf_{time.strftime('%Y%m%d_%H%M%S')}.csv")
+        else:
+            super().keyPressEvent(event)
+
+    def set_perf_enabled(self, enabled):
+        """开关性能统计和浮层；关闭后各阶段不再计时，浮层定时器也停止"""
+        if enabled:
+            if self.perf is None:
+                self.perf = PerfStats()
+            self.capture.perf = self.perf
+            self.update_perf_overlay()
+            self.perf_label.show()
+            self.perf_label.raise_()
+            self.perf_timer.start()
+        else:
+            self.perf_timer.stop()
+            self.perf_label.hide()
+            self.capture.perf = None
+            self.perf = None
+
+    def update_perf_overlay(self):
+        perf = self.perf
+        if perf is None:
+            return
+        lines = [f"FPS  {perf.rate('display'):5.1f}   采集 {perf.rate('capture'):5.1f}"]
+        summary = perf.summary(window=2.0)
+        for stage, name in PerfStats.STAGE_NAMES.items():
+            stats = summary.get(stage)
+            if stats is not None:
+                lines.append(f"{name}  {stats['mean']:6.2f} ms  p95 {stats['p95']:6.2f}")
+        lines.append(f"未显示 {self.compose_stage.in_queue.dropped + self.present_queue.dropped}  "
+                     f"未检测 {self.detect_stage.in_queue.dropped}")
+        lines.append(f"人脸 {len(self.faces)}")
+        self.perf_label.setText("\n".join(lines))
+        self.perf_label.adjustSize()
+
+    def dump_perf(self, path):
+        try:
+            self.perf.dump(path)
+            print(f"性能统计已写入 {path}")
+        except OSError as e:
+            print(f"性能统计导出失败: {e}")
+
+    def update_required_capture_size(self):
+        """把显示和检测实际需要的分辨率告诉画面来源，供缩小解码使用"""
+        width, height = self.display_size
+        if self.detection_max_width is None:
+            # 检测始终使用原始分辨率，不能缩小
+            width = sys.maxsize
+        else:
+            width = max(width, self.detection_max_width)
+        self.cap.set_required_size(width, height)
+
     def on_confidence_change(self, value):
         self.detection_confidence = value / 100.0
-        if hasattr(self, 'detector'):
-            self.detector.setScoreThreshold(self.detection_confidence)
+        if hasattr(self, 'detect_stage'):
+            self.detect_stage.set_score_threshold(self.detection_confidence)
 
     def on_random_clicked(self):
         if self.state == "normal":
             self.state = "random"
             self.btn.setText("重置")
 
-            if len(self.faces) > 0:
-                self.selected_face_index = random.randint(0, len(self.faces) - 1)
-
-                # 捕获静态帧
-                if self.cap and self.cap.isOpened():
-                    ret, img = self.cap.read()
-                    if ret:
-                        img = cv2.flip(img, 1)
-                        img = self.resize_cover(img, self.video_label.width(), self.video_label.height())
-                        self.static_frame = img.copy()
-                        self.faces_snapshot = self.faces.copy()
+            # 直接冻结当前正在显示的画面和它的检测结果，不再读取摄像头，
+            # 红框一定落在屏幕上看到的那一帧上
+            if len(self.faces) > 0 and self.presented_frame is not None:
+                self.selected_face_index = self.faces.random_index()
+                self.static_frame = self.presented_frame.copy()
+                self.faces_snapshot = self.faces.copy()
+                self.show_random_frame()
         else:
             self.state = "normal"
             self.btn.setText("随机")
             self.selected_face_index = -1
             self.static_frame = None
+            self.frozen_pixmap = None
+        self.update_capture_paused()
 
     def on_static_clicked(self):
         """ 静止模式 - 暂停计算但不关闭摄像头，切换更快 """
@@ -307,8 +2593,16 @@ class FaceRandomApp(QWidget):
             # 退出静止模式 - 立即恢复
             self.is_static_mode = False
             self.static_btn.setText("静")
-            
-            # 直接进入下一帧更新，无需重新初始化摄像头
+
+            # 冻结画面没有新帧驱动，直接复用缓存；其他情况直接进入下一帧更新，无需重新初始化摄像头
+            if self.state == "random" and self.static_frame is not None:
+                self.show_random_frame()
+        self.update_capture_paused()
+
+    def update_capture_paused(self):
+        """静止模式或随机冻结画面时不需要新帧，暂停采集线程的读取和解码"""
+        if hasattr(self, 'capture'):
+            self.capture.set_paused(self.is_static_mode or (self.state == "random" and self.static_frame is not None))
     
     def show_static_black_screen(self):
         """显示静态黑屏，缓存结果避免重复计算"""
@@ -321,51 +2615,22 @@ class FaceRandomApp(QWidget):
         
         self.display(self.last_black_frame)
 
-    def resize_cover(self, img, target_w, target_h):
-        h, w = img.shape[:2]
-        scale = max(target_w / w, target_h / h)
-        new_w = int(w * scale)
-        new_h = int(h * scale)
-        resized = cv2.resize(img, (new_w, new_h))
-        x_start = (new_w - target_w) // 2
-        y_start = (new_h - target_h) // 2
-        return resized[y_start:y_start + target_h, x_start:x_start + target_w]
-
-    def draw_face_with_confidence(self, img, face, color, thickness=2):
-        """绘制人脸框和置信度，增加对无效坐标的检查"""
-        try:
-            # 检查坐标是否有效（不是inf或nan）
-            x, y, w, h = face[:4]
-            
-            # 检查是否为有限数值
-            if (not np.isfinite(x) or not np.isfinite(y) or 
-                not np.isfinite(w) or not np.isfinite(h)):
-                return
-            
-            # 检查坐标是否在合理范围内
-            img_h, img_w = img.shape[:2]
-            if (x < -img_w or x > img_w * 2 or 
-                y < -img_h or y > img_h * 2 or
-                w <= 0 or h <= 0 or w > img_w * 2 or h > img_h * 2):
-                return
-            
-            # 转换为整数
-            x, y, w, h = map(int, (x, y, w, h))
-            
-            # 确保坐标在图像范围内
-            x = max(0, min(x, img_w - 1))
-            y = max(0, min(y, img_h - 1))
-            w = max(1, min(w, img_w - x))
-            h = max(1, min(h, img_h - y))
-            
-            # 绘制人脸矩形框
-            cv2.rectangle(img, (x, y), (x + w, y + h), color, thickness)
-        except (ValueError, OverflowError) as e:
-            # 如果转换失败，跳过这个检测框
-            print(f"绘制人脸框时出错: {e}")
-            return
+    def resize_cover(self, img, target_w, target_h, mirror=False, avoid=None):
+        """
+        按 cover 方式缩放并裁剪（可同时镜像）。
+        返回的是几何缓存中轮换复用的连续缓冲区（不会是 avoid），需要长期保留时请复制。
+        """
+        key = (img.shape, target_w, target_h, mirror)
+        geometry = self.geometry_cache.get(key)
+        if geometry is None:
+            geometry = CoverGeometry(img.shape, target_w, target_h, mirror)
+            self.geometry_cache[key] = geometry
+        return geometry.apply(img, avoid)
 
     def update_frame(self):
+        """新画面到达时由合成阶段的 frame_ready 信号触发"""
+        self.compose_stage.acknowledge()
+
         # 如果处于静止模式，只显示黑屏，不进行任何计算
         if self.is_static_mode:
             # 检查是否已经有缓存的黑屏帧
@@ -377,80 +2642,93 @@ class FaceRandomApp(QWidget):
         if not self.cap or not self.cap.isOpened():
             return
 
-        ret, img = self.cap.read()
-        if not ret:
-            # 如果读取失败，尝试重新获取一帧，最多尝试3次
-            for _ in range(3):
-                ret, img = self.cap.read()
-                if ret:
-                    break
-            if not ret:
-                return
+        # 随机模式的冻结画面在点击时已经显示，之后不再重绘
+        if self.state == "random" and self.static_frame is not None:
+            return
 
-        # 镜像翻转
-        img = cv2.flip(img, 1)
+        # 取合成阶段输出的最新画面和与之对应的检测结果
+        item = self.present_queue.get_nowait()
+        if item is None:
+            # 没有新画面，跳过本次刷新
+            return
+        self.presented_frame, self.faces = item
 
-        # resize_cover方法，保持视野大小
-        img = self.resize_cover(img, self.video_label.width(), self.video_label.height())
+        # 绘制检测结果（正常模式绘制全部绿色框）
+        self.display(self.presented_frame, self.faces, FACE_COLOR, 2)
 
-        if self.state == "normal":
-            if hasattr(self, 'detector') and self.detector is not None:
-                # 设置检测器输入大小
-                self.detector.setInputSize((img.shape[1], img.shape[0]))
+    def show_random_frame(self):
+        """
+        显示冻结的画面，仅绘制被选中的红色框，其他不显示。
+        合成好的 QPixmap 只在点击时生成一次，直到重置或窗口大小变化前都直接复用。
+        """
+        if self.frozen_pixmap is not None:
+            self.video_label.setPixmap(self.frozen_pixmap)
+            return
 
-                # 检测人脸
-                try:
-                    _, detected = self.detector.detect(img)
-                    
-                    # 过滤无效的检测结果
-                    if detected is not None:
-                        valid_faces = []
-                        for face in detected:
-                            # 检查是否包含无效值
-                            if np.all(np.isfinite(face[:4])):
-                                valid_faces.append(face)
-                        self.faces = valid_faces
-                    else:
-                        self.faces = []
-                        
-                except Exception as e:
-                    print(f"人脸检测出错: {e}")
-                    self.faces = []
-
-                # 绘制检测结果（正常模式绘制全部绿色框）
-                for face in self.faces:
-                    self.draw_face_with_confidence(img, face, (0, 255, 0), 2)
-            else:
-                # 如果没有模型，只显示原始图像
-                pass
-        else:  # random 模式
-            if self.static_frame is not None:
-                img = self.static_frame.copy()
-                # 仅绘制被选中的红色框，其他不显示
-                if self.selected_face_index != -1 and len(self.faces_snapshot) > self.selected_face_index:
-                    face = self.faces_snapshot[self.selected_face_index]
-                    self.draw_face_with_confidence(img, face, (0, 0, 255), 3)
-
-        self.display(img)
-
-    def display(self, img):
-        # 图像显示
-        rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        h, w, c = rgb.shape
-        qimg = QImage(rgb.data, w, h, c * w, QImage.Format_RGB888)
-        self.video_label.setPixmap(QPixmap.fromImage(qimg))
+        img, faces = self.static_frame, self.faces_snapshot
+        target_w, target_h = self.display_size
+        if img.shape[:2] != (target_h, target_w):
+            # 窗口大小变化：从点击时保存的画面按当前尺寸重新合成
+            scale, x_off, y_off = cover_transform(img.shape[1], img.shape[0], target_w, target_h)
+            img = self.resize_cover(img, target_w, target_h)
+            faces = faces.mapped(scale, x_off, y_off)
+
+        selected = FaceSet()
+        if self.selected_face_index != -1 and len(faces) > self.selected_face_index:
+            selected = faces[self.selected_face_index:self.selected_face_index + 1]
+        self.frozen_pixmap = self.display(img, selected, SELECTED_COLOR, 3)
+
+    def display(self, img, faces=None, color=FACE_COLOR, thickness=2):
+        # 图像显示：画面写入复用的显示缓冲区，人脸框直接画在缓冲区上
+        perf = self.perf
+        if perf is None:
+            buffer = self.display_buffer.load(img)
+            if faces is not None and len(faces):
+                faces.draw(buffer, color, thickness)
+            pixmap = self.display_buffer.to_pixmap()
+            self.video_label.setPixmap(pixmap)
+            return pixmap
+
+        start = time.perf_counter()
+        buffer = self.display_buffer.load(img)
+        draw_start = time.perf_counter()
+        if faces is not None and len(faces):
+            faces.draw(buffer, color, thickness)
+        draw_end = time.perf_counter()
+        pixmap = self.display_buffer.to_pixmap()
+        self.video_label.setPixmap(pixmap)
+        end = time.perf_counter()
+        perf.record("draw", draw_start, draw_end)
+        # 显示阶段 = 格式转换 + 生成 QPixmap + setPixmap，不含绘制
+        perf.record("display", start, end - (draw_end - draw_start))
+        return pixmap
 
     def closeEvent(self, event):
-        # 停止定时器
-        if hasattr(self, 'timer') and self.timer.isActive():
-            self.timer.stop()
-        
+        # 停止流水线各阶段（采集线程必须在释放摄像头之前停止）
+        if hasattr(self, 'capture') and self.capture.isRunning():
+            self.capture.stop()
+            fps = 1.0 / self.capture.frame_interval if self.capture.frame_interval else 0.0
+            print(f"采集统计: 共 {self.capture.captured_frames} 帧 ({fps:.1f} fps), "
+                  f"未显示 {self.compose_stage.in_queue.dropped + self.present_queue.dropped} 帧, "
+                  f"未检测 {self.detect_stage.in_queue.dropped} 帧, "
+                  f"完整检测 {self.detect_stage.detector_calls} 次, 光流跟踪 {self.detect_stage.tracked_frames} 帧")
+        for stage in (getattr(self, 'detect_stage', None), getattr(self, 'compose_stage', None)):
+            if stage is not None and stage.isRunning():
+                stage.stop()
+        if getattr(self, 'detector', None) is not None:
+            self.detector.close()
+        if getattr(self, 'perf', None) is not None and self.perf_dump_path:
+            self.dump_perf(self.perf_dump_path)
+
         # 释放摄像头
         if hasattr(self, 'cap') and self.cap and self.cap.isOpened():
             self.cap.release()
         
         # 终止线程
-        if hasattr(self, 'loader') and self.loader.isRunning():
+        if getattr(self, 'camera_loader', None) is not None and self.camera_loader.isRunning():
+            self.camera_loader.wait()
+        if getattr(self, 'loader', None) is not None and self.loader.isRunning():
+            self.loader.warmup_ready.set()  # 还在等摄像头时不再等待
             self.loader.quit()
             self.loader.wait()
         
@@ -458,9 +2736,65 @@ class FaceRandomApp(QWidget):
 
 
 # ======================================================
+def parse_args(argv):
+    """
+    命令行参数；未指定时读取环境变量 FACE_RANDOM_SOURCE / FACE_RANDOM_FPS / FACE_RANDOM_REDUCED_DECODE /
+    FACE_RANDOM_DETECT_INTERVAL / FACE_RANDOM_DETECT_WIDTH。
+    其余参数原样交给 Qt。
+    """
+    parser = argparse.ArgumentParser(description="Face Random Selector")
+    parser.add_argument("--source", default=os.environ.get("FACE_RANDOM_SOURCE"),
+                        help="画面来源：camera[:序号]、synthetic[:宽x高]、视频文件或图片文件夹，默认摄像头")
+    parser.add_argument("--fps", type=float,
+                        default=float(os.environ["FACE_RANDOM_FPS"]) if os.environ.get("FACE_RANDOM_FPS") else None,
+                        help="非摄像头来源的出帧帧率，0 表示不限速；视频文件默认使用文件帧率")
+    parser.add_argument("--probe-camera", action="store_true",
+                        help="忽略缓存，重新协商摄像头后端和格式（更换摄像头后使用）")
+    parser.add_argument("--detect-interval", type=int,
+                        default=int(os.environ.get("FACE_RANDOM_DETECT_INTERVAL", 5)),
+                        help="每隔几帧完整检测一次，中间帧光流跟踪；1 表示每帧检测，默认 5")
+    parser.add_argument("--detect-width", type=int,
+                        default=int(os.environ.get("FACE_RANDOM_DETECT_WIDTH", 1280)),
+                        help="检测分辨率上限（宽度），0 表示始终用原始分辨率，默认 1280；--tiles 时忽略")
+    parser.add_argument("--tiles", action="store_true",
+                        help="分块检测：在原始分辨率的重叠分块上并发检测，提高后排小人脸的检出率")
+    parser.add_argument("--tile-size", type=int, default=640, help="分块边长（像素），默认 640")
+    parser.add_argument("--tile-overlap", type=int, default=128,
+                        help="相邻分块的重叠（像素），应不小于最大人脸尺寸，默认 128")
+    parser.add_argument("--tile-workers", type=int, default=None, help="分块检测的线程数，默认 CPU 核数")
+    parser.add_argument("--reduced-decode", action="store_true",
+                        default=bool(os.environ.get("FACE_RANDOM_REDUCED_DECODE")),
+                        help="摄像头输出 MJPG 时直接取压缩数据，按显示和检测需要的分辨率缩小解码")
+    parser.add_argument("--embed-model", nargs="?", const=EMBEDDED_MODEL_MODULE + ".py", metavar="OUTPUT",
+                        help=f"把模型写成 Python 模块（默认 {EMBEDDED_MODEL_MODULE}.py）供打包使用，然后退出")
+    parser.add_argument("--detector", choices=tuple(DETECTOR_BACKENDS),
+                        default=os.environ.get("FACE_RANDOM_DETECTOR", "yunet"),
+                        help="检测后端：yunet（默认）、mediapipe（需要 cvzone）或 haar")
+    parser.add_argument("--serve", action="store_true",
+                        help="以常驻服务运行：在后台保持预热好的检测器，之后启动的程序直接使用，按 Ctrl+C 退出")
+    parser.add_argument("--serve-camera", action="store_true",
+                        help="与 --serve 一起使用，服务同时保持摄像头（或 --source 指定的来源）常开")
+    parser.add_argument("--no-service", action="store_true", help="不使用常驻服务，自己加载模型、打开摄像头")
+    return parser.parse_known_args(argv)
+
+
 def main():
-    app = QApplication(sys.argv)
-    window = FaceRandomApp()
+    args, qt_args = parse_args(sys.argv[1:])
+    if args.embed_model:
+        size = write_embedded_model(default_model_path(), args.embed_model)
+        print(f"已生成 {args.embed_model}（{size} 字节）")
+        return
+    if args.serve:
+        run_service(args.source, args.serve_camera, args.probe_camera)
+        return
+    app = QApplication(sys.argv[:1] + qt_args)
+    tiling = None
+    if args.tiles:
+        tiling = {"tile_size": args.tile_size, "overlap": args.tile_overlap, "workers": args.tile_workers}
+    window = FaceRandomApp(source=args.source, source_fps=args.fps, probe_camera=args.probe_camera,
+                           reduced_decode=args.reduced_decode, tiling=tiling, use_service=not args.no_service,
+                           backend=args.detector, detect_interval=args.detect_interval,
+                           detect_width=args.detect_width)
     # 注意：这里不再调用 window.show()，因为 FaceRandomApp 内部会处理显示逻辑
     sys.exit(app.exec())
 
@@ -1,13 +1,59 @@
 import sys
+import os
+import json
+import time
 import random
-import cv2
-import numpy as np
-from cvzone.FaceDetectionModule import FaceDetector
-from PySide6.QtCore import QTimer, Qt
+from concurrent.futures import ThreadPoolExecutor
+
+# 启动前只导入 PySide6；cv2、numpy 和 cvzone（会加载 MediaPipe）在加载界面出现后
+# 由后台线程导入（见 import_heavy_modules）
+START_TIME = time.perf_counter()
+from PySide6.QtCore import QTimer, Qt, QThread, Signal
 from PySide6.QtGui import QImage, QPixmap
 from PySide6.QtWidgets import (QApplication, QWidget, QLabel, QPushButton, 
                                QVBoxLayout, QProgressBar, QHBoxLayout, 
                                QSlider, QGroupBox, QDoubleSpinBox)
+IMPORT_TIMINGS = {"PySide6": (time.perf_counter() - START_TIME) * 1000}  # 各模块导入耗时（毫秒）
+
+cv2 = None
+np = None
+FaceDetector = None
+
+# 每次启动的耗时记录（每行一个 JSON）
+STARTUP_LOG_PATH = os.path.join(os.path.expanduser("~"), ".face_random", "startup.jsonl")
+
+
+def import_heavy_modules():
+    """依次导入 numpy、cv2、cvzone 并记录耗时；重复调用时直接返回"""
+    global cv2, np, FaceDetector
+    if np is None:
+        start = time.perf_counter()
+        import numpy
+        np = numpy
+        IMPORT_TIMINGS["numpy"] = (time.perf_counter() - start) * 1000
+    if cv2 is None:
+        start = time.perf_counter()
+        import cv2 as cv2_module
+        cv2 = cv2_module
+        IMPORT_TIMINGS["cv2"] = (time.perf_counter() - start) * 1000
+    if FaceDetector is None:
+        start = time.perf_counter()
+        from cvzone.FaceDetectionModule import FaceDetector as detector_class
+        FaceDetector = detector_class
+        IMPORT_TIMINGS["cvzone"] = (time.perf_counter() - start) * 1000
+    return IMPORT_TIMINGS
+
+
+def record_startup(timings, path=STARTUP_LOG_PATH):
+    """把本次启动的耗时追加到日志文件（打包后没有控制台，print 的内容看不到）"""
+    entry = {"time": time.strftime("%Y-%m-%d %H:%M:%S"), "script": os.path.basename(__file__)}
+    entry.update({name: round(ms, 1) for name, ms in timings.items()})
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    except OSError as e:
+        print(f"启动耗时记录写入失败: {e}")
 
 
 class LoadingScreen(QWidget):
@@ -49,9 +95,146 @@ class LoadingScreen(QWidget):
         self.setLayout(layout)
 
 
+# 多尺度检测的缩放因子
+DETECTION_SCALES = (1.0, 0.75, 0.5)
+
+
+def nms_faces(faces, iou_threshold=0.4):
+    """
+    合并多个尺度的检测结果：框和置信度组成数组后交给 cv2.dnn.NMSBoxes，
+    同一张脸只保留置信度最高的一个
+    """
+    if len(faces) < 2:
+        return faces
+    boxes = [face["bbox"] for face in faces]
+    scores = [float(face["score"][0]) for face in faces]
+    keep = cv2.dnn.NMSBoxes(boxes, scores, 0.0, iou_threshold)
+    return [faces[i] for i in np.asarray(keep).reshape(-1)]
+
+
+def detect_at_scale(detector, img, scale):
+    """在一个尺度上检测，坐标换算回原始尺度（findFaces 在 draw=False 时不修改输入图像）"""
+    if scale != 1.0:
+        h, w = img.shape[:2]
+        img = cv2.resize(img, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+    _, faces = detector.findFaces(img, draw=False)
+    faces = faces or []
+    if scale != 1.0:
+        for face in faces:
+            x, y, w, h = (int(v / scale) for v in face["bbox"])
+            face["bbox"] = [x, y, w, h]
+            face["center"] = (x + w // 2, y + h // 2)
+    return faces
+
+
+def prepare_frame(img, size):
+    """摄像头画面镜像后缩放到显示尺寸，检测和显示都在这张图上进行"""
+    return cv2.resize(cv2.flip(img, 1), size)
+
+
+def create_scale_detectors(model_selection, confidence):
+    """每个检测尺度创建一个检测器（FaceDetector 实例不能被多个线程同时使用）"""
+    return {
+        scale: FaceDetector(minDetectionCon=confidence, modelSelection=model_selection)
+        for scale in DETECTION_SCALES
+    }
+
+
+class DetectorLoader(QThread):
+    """在后台创建检测器，切换模型时界面和视频不卡顿"""
+    loaded = Signal(int, object, str)  # 模型类型, 各尺度检测器, 错误信息
+
+    def __init__(self, model_selection, confidence):
+        super().__init__()
+        self.model_selection = model_selection
+        self.confidence = confidence
+
+    def run(self):
+        try:
+            detectors = create_scale_detectors(self.model_selection, self.confidence)
+            self.loaded.emit(self.model_selection, detectors, "")
+        except Exception as e:
+            self.loaded.emit(self.model_selection, None, str(e))
+
+
+class StartupLoader(QThread):
+    """
+    后台完成启动准备：打开摄像头并取到第一帧，创建各尺度的检测器并在第一帧上预热。
+    预热的检测结果就是主窗口显示的第一帧，界面线程不用再读取和检测一次。
+    各步骤完成的时间（相对启动时刻，毫秒）记录在 timings 中。
+    """
+    progress = Signal(str)
+    finished_loading = Signal(str)  # 错误信息，成功时为空
+
+    def __init__(self, start_time, model_selection, confidence, display_size):
+        super().__init__()
+        self.start_time = start_time
+        self.model_selection = model_selection
+        self.confidence = confidence
+        self.display_size = display_size
+        self.cap = None
+        self.scale_detectors = {}
+        self.first_frame = None  # 镜像并缩放到显示尺寸后的第一帧
+        self.first_faces = []
+        self.timings = {}
+
+    def mark(self, name):
+        self.timings[name] = (time.perf_counter() - self.start_time) * 1000
+
+    def run(self):
+        # ---------------- 运行库 ----------------
+        self.progress.emit("正在加载运行库...")
+        try:
+            import_heavy_modules()
+        except Exception as e:
+            # cv2 不可用时无法继续；只是 cvzone 不可用时照常打开摄像头，以基础模式运行
+            if cv2 is None:
+                self.finished_loading.emit(f"{type(e).__name__}: {e}")
+                return
+            import_error = f"{type(e).__name__}: {e}"
+        else:
+            import_error = ""
+        self.mark("运行库导入")
+
+        # ---------------- 摄像头 ----------------
+        self.progress.emit("正在打开摄像头...")
+        self.cap = cv2.VideoCapture(0)
+        # 设置更高分辨率以捕捉更多细节
+        self.cap.set(3, 1920)  # 宽度
+        self.cap.set(4, 1080)  # 高度
+        self.mark("摄像头打开")
+        if self.cap.isOpened():
+            ret, img = self.cap.read()
+            if ret:
+                self.first_frame = prepare_frame(img, self.display_size)
+                self.mark("首帧")
+
+        if import_error:
+            self.finished_loading.emit(import_error)
+            return
+
+        self.progress.emit("正在初始化人脸检测模型...")
+        try:
+            self.scale_detectors = create_scale_detectors(self.model_selection, self.confidence)
+            self.mark("模型加载")
+            # 每个尺度在第一帧上检测一次，首次推理的开销不出现在实时画面中；
+            # 合并后的结果就是第一帧的多尺度检测结果
+            if self.first_frame is not None:
+                faces = [face for scale, detector in self.scale_detectors.items()
+                         for face in detect_at_scale(detector, self.first_frame, scale)]
+                self.first_faces = nms_faces(faces)
+                self.mark("模型预热")
+        except Exception as e:
+            self.scale_detectors = {}
+            self.finished_loading.emit(str(e))
+            return
+        self.finished_loading.emit("")
+
+
 class FaceRandomApp(QWidget):
     def __init__(self):
         super().__init__()
+        self.start_time = time.perf_counter()
         
         # 先显示加载页面
         self.loading_screen = LoadingScreen()
@@ -60,8 +243,8 @@ class FaceRandomApp(QWidget):
         # 强制立即处理GUI事件，确保加载页面能立即显示
         QApplication.processEvents()
         
-        # 延迟初始化主界面，让加载页面先显示
-        QTimer.singleShot(100, self.initialize_app)
+        # 摄像头和模型在后台准备，界面不需要再等待固定的时间
+        self.initialize_app()
 
     def initialize_app(self):
         # 设置窗口标题
@@ -79,52 +262,77 @@ class FaceRandomApp(QWidget):
         self.control_panel_visible = False  # 控制面板显示状态
         self.multi_scale_enabled = True  # 启用多尺度检测
 
-        # ---------------- 摄像头 ----------------
-        self.cap = cv2.VideoCapture(0)
-        
-        # 设置更高分辨率以捕捉更多细节
-        self.cap.set(3, 1920)  # 宽度
-        self.cap.set(4, 1080)  # 高度
-        
         # 设置窗口初始大小
         self.resize(1280, 720)
         
-        # 更新加载页面文字，提示正在进行人脸模型初始化
-        self.loading_screen.loading_label.setText("正在初始化人脸检测模型...")
-        QApplication.processEvents()
-        
-        # 使用优化的参数
-        try:
-            self.detector = FaceDetector(
-                minDetectionCon=self.detection_confidence, 
-                modelSelection=self.model_selection
-            )
-            self.loading_screen.loading_label.setText("人脸模型加载完成!")
-        except Exception as e:
-            print(f"初始化人脸检测器时出错: {e}")
-            # 如果初始化失败，使用一个空的检测器
-            self.detector = None
-            self.loading_screen.loading_label.setText("人脸模型加载失败，使用基础模式")
+        # 多尺度检测时每个尺度一个检测器，在线程池中并发运行
+        self.scale_pool = ThreadPoolExecutor(max_workers=len(DETECTION_SCALES))
+        # 已加载的检测器按模型类型缓存，来回切换时直接复用
+        self.detector_cache = {}
+        self.detector_loaders = {}  # 正在后台加载的模型类型 -> DetectorLoader
+        self.scale_detectors = {}
+        self.detector = None
+        self.cap = None
 
         # ---------------- 创建界面 ----------------
         self.setup_ui()
 
         self.faces = []
-        
-        # 模拟加载完成
-        QTimer.singleShot(1500, self.finish_loading)
 
-    def finish_loading(self):
-        # 关闭加载页面
+        # 摄像头、首帧和检测模型都准备好后再显示主窗口
+        self.loader = StartupLoader(self.start_time, self.model_selection, self.detection_confidence,
+                                    (self.video_label.width(), self.video_label.height()))
+        self.loader.progress.connect(self.loading_screen.loading_label.setText)
+        self.loader.finished_loading.connect(self.finish_loading)
+        self.loader.start()
+
+    def finish_loading(self, error):
+        self.loader.wait()
+        self.cap = self.loader.cap
+        if cv2 is None:
+            print(f"运行库加载失败: {error}")
+            self.abort_startup("运行库加载失败")
+            return
+        if error:
+            print(f"初始化人脸检测器时出错: {error}")
+            # 如果初始化失败，使用一个空的检测器
+            self.loading_screen.loading_label.setText("人脸模型加载失败，使用基础模式")
+        else:
+            self.detector_cache[self.loader.model_selection] = self.loader.scale_detectors
+            # 加载期间可能切换过模型或调整过置信度
+            if self.model_selection == self.loader.model_selection:
+                self.use_detectors(self.loader.scale_detectors)
+            else:
+                self.on_model_changed(self.model_selection)
+
+        # 先显示后台已经检测好的第一帧，再关闭加载页面、显示主窗口
+        if self.loader.first_frame is not None:
+            self.show_live_frame(self.loader.first_frame, self.loader.first_faces)
         self.loading_screen.close()
-        # 显示主窗口
         self.show()
+        self.loader.mark("首帧显示")
+        print("导入耗时: " + ", ".join(f"{name} {ms:.0f} ms" for name, ms in IMPORT_TIMINGS.items()))
+        print("启动耗时: " + ", ".join(f"{name} {ms:.0f} ms" for name, ms in self.loader.timings.items()))
+        timings = {f"import {name}": ms for name, ms in IMPORT_TIMINGS.items()}
+        timings.update(self.loader.timings)
+        record_startup(timings)
         
         # 启动定时器更新视频帧
         self.timer = QTimer()
         self.timer.timeout.connect(self.update_frame)
         self.timer.start(30)
 
+    def abort_startup(self, message, delay=3000):
+        """启动失败：在加载界面上显示原因，稍后关闭并以非零状态退出（加载界面无边框，用户无法自行关闭）"""
+        self.loading_screen.loading_label.setText(message)
+        self.loading_screen.progress_bar.hide()
+
+        def quit_app():
+            self.loading_screen.close()
+            QApplication.exit(1)
+
+        QTimer.singleShot(delay, quit_app)
+
     def setup_ui(self):
         # 视频标签 - 填充整个窗口
         self.video_label = QLabel(self)
@@ -303,8 +511,8 @@ class FaceRandomApp(QWidget):
         confidence = value / 100.0
         self.confidence_value.setText(f"{confidence:.2f}")
         self.detection_confidence = confidence
-        if self.detector:
-            self.detector.minDetectionCon = confidence
+        for detector in self.scale_detectors.values():
+            detector.minDetectionCon = confidence
 
     def on_multiscale_changed(self):
         """多尺度检测选项改变"""
@@ -320,72 +528,47 @@ class FaceRandomApp(QWidget):
             self.model_short_btn.setChecked(False)
             self.model_long_btn.setChecked(True)
         
-        # 重新初始化检测器
-        try:
-            self.detector = FaceDetector(
-                minDetectionCon=self.detection_confidence,
-                modelSelection=model_selection
-            )
-        except Exception as e:
-            print(f"重新初始化检测器失败: {e}")
+        # 已缓存的直接切换；否则在后台加载，加载完成前继续使用当前检测器
+        if model_selection in self.detector_cache:
+            self.use_detectors(self.detector_cache[model_selection])
+        elif model_selection not in self.detector_loaders:
+            loader = DetectorLoader(model_selection, self.detection_confidence)
+            loader.loaded.connect(self.on_detectors_loaded)
+            self.detector_loaders[model_selection] = loader
+            loader.start()
+
+    def on_detectors_loaded(self, model_selection, detectors, error):
+        """后台加载完成：缓存起来，如果用户仍然选着这个模型就立即切换"""
+        loader = self.detector_loaders.pop(model_selection, None)
+        if loader is not None:
+            loader.wait()
+        if detectors is None:
+            print(f"重新初始化检测器失败: {error}")
+            return
+        self.detector_cache[model_selection] = detectors
+        if self.model_selection == model_selection:
+            self.use_detectors(detectors)
+
+    def use_detectors(self, detectors):
+        # 缓存中的检测器可能是按旧的置信度创建的
+        for detector in detectors.values():
+            detector.minDetectionCon = self.detection_confidence
+        self.scale_detectors = detectors
+        self.detector = detectors[1.0]
 
     def multi_scale_detection(self, img):
-        """多尺度人脸检测，提高小尺寸人脸的检测率"""
+        """多尺度人脸检测，提高小尺寸人脸的检测率；各尺度并发运行，总耗时接近最慢的单个尺度"""
         if not self.multi_scale_enabled or self.detector is None:
             return self.detector.findFaces(img, draw=False) if self.detector else (img, [])
-        
-        faces = []
-        scales = [1.0, 0.75, 0.5]  # 多尺度因子
-        
-        for scale in scales:
-            # 缩放图像
-            if scale != 1.0:
-                h, w = img.shape[:2]
-                new_w, new_h = int(w * scale), int(h * scale)
-                scaled_img = cv2.resize(img, (new_w, new_h))
-            else:
-                scaled_img = img.copy()
-            
-            # 在当前尺度下检测人脸
-            _, scaled_faces = self.detector.findFaces(scaled_img, draw=False)
-            
-            # 将检测到的人脸坐标转换回原始尺度
-            if scaled_faces:
-                for face in scaled_faces:
-                    bbox = face["bbox"]
-                    # 调整边界框坐标
-                    face["bbox"] = [
-                        int(bbox[0] / scale),
-                        int(bbox[1] / scale),
-                        int(bbox[2] / scale),
-                        int(bbox[3] / scale)
-                    ]
-                    # 只添加新检测到的人脸（避免重复）
-                    if not self.is_duplicate_face(face, faces):
-                        faces.append(face)
-        
-        return img, faces
-
-    def is_duplicate_face(self, new_face, existing_faces, threshold=0.5):
-        """检查是否重复检测到同一个人脸"""
-        if not existing_faces:
-            return False
-            
-        new_x, new_y, new_w, new_h = new_face["bbox"]
-        new_center = (new_x + new_w/2, new_y + new_h/2)
-        
-        for face in existing_faces:
-            x, y, w, h = face["bbox"]
-            center = (x + w/2, y + h/2)
-            
-            # 计算两个边界框中心点的距离
-            distance = np.sqrt((new_center[0] - center[0])**2 + (new_center[1] - center[1])**2)
-            
-            # 如果距离小于阈值，认为是同一个人脸
-            if distance < max(new_w, new_h) * threshold:
-                return True
-                
-        return False
+
+        jobs = [
+            self.scale_pool.submit(detect_at_scale, detector, img, scale)
+            for scale, detector in self.scale_detectors.items()
+        ]
+        faces = [face for job in jobs for face in job.result()]
+
+        # 同一张脸在多个尺度上都会被检出，按 IoU 做非极大值抑制
+        return img, nms_faces(faces)
 
     def resizeEvent(self, event):
         """窗口大小改变时自动调整视频和按钮位置"""
@@ -443,9 +626,8 @@ class FaceRandomApp(QWidget):
                 # 保存当前帧作为静态画面
                 ret, img = self.cap.read()
                 if ret:
-                    img = cv2.flip(img, 1)
-                    # 调整图像大小以适应窗口
-                    img = cv2.resize(img, (self.video_label.width(), self.video_label.height()))
+                    # 镜像并调整图像大小以适应窗口
+                    img = prepare_frame(img, (self.video_label.width(), self.video_label.height()))
                     self.static_frame = img.copy()
                     self.all_faces_snapshot = self.faces.copy()
         else:  # self.state == "random"
@@ -468,33 +650,18 @@ class FaceRandomApp(QWidget):
             if not ret:
                 return
 
-            img = cv2.flip(img, 1)
-            
-            # 调整图像大小以适应窗口
-            img = cv2.resize(img, (self.video_label.width(), self.video_label.height()))
+            # 镜像并调整图像大小以适应窗口
+            img = prepare_frame(img, (self.video_label.width(), self.video_label.height()))
 
             # 检测人脸 - 使用多尺度检测
             if self.detector is not None:
                 if self.multi_scale_enabled:
-                    img, self.faces = self.multi_scale_detection(img)
+                    img, faces = self.multi_scale_detection(img)
                 else:
-                    img, self.faces = self.detector.findFaces(img, draw=False)
-                self.faces = self.faces if self.faces else []
+                    img, faces = self.detector.findFaces(img, draw=False)
             else:
-                self.faces = []
-
-            # 绘制所有人脸为绿色
-            for face in self.faces:
-                x, y, w, h = face["bbox"]
-                score = face["score"][0]
-                # 根据置信度调整边框粗细
-                thickness = max(1, int(3 * score))
-                cv2.rectangle(img, (x, y), (x + w, y + h), (0, 255, 0), thickness)
-                cv2.putText(img, f"{score:.2f}", (x, y - 10),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
-
-            # 显示图像
-            self.display_image(img)
+                faces = []
+            self.show_live_frame(img, faces)
 
         # ============================
         # 状态：random（显示静态画面，选中的人脸为红色，其他为绿色）
@@ -521,6 +688,21 @@ class FaceRandomApp(QWidget):
             # 显示图像
             self.display_image(img)
 
+    def show_live_frame(self, img, faces):
+        """记录检测结果，所有人脸画绿框后显示"""
+        self.faces = faces if faces else []
+        for face in self.faces:
+            x, y, w, h = face["bbox"]
+            score = face["score"][0]
+            # 根据置信度调整边框粗细
+            thickness = max(1, int(3 * score))
+            cv2.rectangle(img, (x, y), (x + w, y + h), (0, 255, 0), thickness)
+            cv2.putText(img, f"{score:.2f}", (x, y - 10),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+
+        # 显示图像
+        self.display_image(img)
+
     # ---------------------------------------------------------
     # 显示图像到 QLabel
     # ---------------------------------------------------------
@@ -533,8 +715,15 @@ class FaceRandomApp(QWidget):
 
     # ---------------------------------------------------------
     def closeEvent(self, event):
-        if self.cap.isOpened():
+        if hasattr(self, 'loader') and self.loader.isRunning():
+            self.loader.wait()
+            self.cap = self.loader.cap
+        if self.cap is not None and self.cap.isOpened():
             self.cap.release()
+        if hasattr(self, 'scale_pool'):
+            self.scale_pool.shutdown(wait=False)
+        for loader in getattr(self, 'detector_loaders', {}).values():
+            loader.wait()
         event.accept()
 
 
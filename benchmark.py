@@ -0,0 +1,386 @@
+"""
+3-7.py 检测路径的无界面端到端基准测试。
+
+不需要摄像头和窗口：把视频文件或合成画面按 3-7.py 的同一套步骤处理
+（resize_cover、检测输入预处理、人脸检测、有效性过滤、绘制人脸框、显示转换），
+在多个目标分辨率下统计各阶段耗时分位数、持续帧率和内存峰值，并可输出 JSON 便于跟踪性能回退。
+
+--backends 指定多个检测后端（yunet、mediapipe、haar）时，在同一段画面上逐个测试，
+并以 --reference 指定的后端为基准统计各后端检出结果的召回率和精确率（IoU >= 0.5 算同一张脸），
+用来为每台教室电脑挑选足够准确的前提下最快的后端。没有标注数据，基准后端的结果只是近似的参照。
+
+用法示例：
+    python benchmark.py --video classroom.mp4 --resolutions 1280x720,1920x1080,3840x2160 --json result.json
+    python benchmark.py --synthetic 1280x720 --frames 200
+    python benchmark.py --video lecture_hall.mp4 --tiles --tile-size 640,480 --tile-overlap 96,128
+    python benchmark.py --video classroom.mp4 --resolutions 1280x720 --backends yunet,mediapipe,haar
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+# 无界面运行：QPixmap 需要 QGuiApplication，使用 offscreen 平台插件
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import cv2
+import numpy as np
+from PySide6.QtGui import QGuiApplication
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_SCRIPT = os.path.join(BASE_DIR, "3-7.py")
+DEFAULT_MODEL = os.path.join(BASE_DIR, "model", "face_detection_yunet_2023mar.onnx")
+
+STAGES = ("resize_cover", "detect_input", "detect", "filter", "display_convert", "draw", "to_pixmap")
+
+
+def load_app_module(path=APP_SCRIPT):
+    """按文件路径加载 3-7.py（文件名不是合法的模块名），复用其中的实现"""
+    spec = importlib.util.spec_from_file_location("face_random_app", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    # 3-7.py 在加载界面出现后才导入 cv2 和 numpy，这里直接导入
+    module.import_heavy_modules()
+    return module
+
+
+# ======================================================
+# 输入画面
+# ======================================================
+def parse_size(text):
+    w, h = text.lower().split("x")
+    return int(w), int(h)
+
+
+def video_frames(path, count):
+    """从视频文件读取 count 帧，不够时从头循环"""
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise SystemExit(f"无法打开视频: {path}")
+    frames = []
+    while len(frames) < count:
+        ret, frame = cap.read()
+        if not ret:
+            if not frames:
+                raise SystemExit(f"视频中没有可读取的帧: {path}")
+            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            continue
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def synthetic_frames(size, count, seed=0):
+    """生成带纹理和移动色块的合成画面（不含人脸，只用于测量固定开销）"""
+    w, h = size
+    rng = np.random.default_rng(seed)
+    base = cv2.GaussianBlur(rng.integers(0, 256, (h, w, 3), dtype=np.uint8), (0, 0), 3)
+    frames = []
+    for i in range(count):
+        frame = base.copy()
+        x = int((w - 200) * (0.5 + 0.5 * np.sin(i / 15)))
+        cv2.rectangle(frame, (x, h // 3), (x + 200, h // 3 + 200), (40, 180, 220), -1)
+        frames.append(frame)
+    return frames
+
+
+# ======================================================
+# 测量
+# ======================================================
+def percentiles(samples_ms):
+    a = np.asarray(samples_ms, np.float64)
+    return {
+        "mean": float(a.mean()),
+        "p50": float(np.percentile(a, 50)),
+        "p90": float(np.percentile(a, 90)),
+        "p99": float(np.percentile(a, 99)),
+        "max": float(a.max()),
+    }
+
+
+def peak_rss_mb():
+    """进程峰值常驻内存（MB），平台不支持时返回 None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为 KB，macOS 为字节
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def match_count(boxes, reference, iou_threshold=0.5):
+    """按 IoU 从高到低贪心匹配两组 (N, 5) 框，返回匹配上的对数"""
+    if len(boxes) == 0 or len(reference) == 0:
+        return 0
+    a = boxes[:, None, :4]
+    b = reference[None, :, :4]
+    iw = np.clip(np.minimum(a[..., 0] + a[..., 2], b[..., 0] + b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    ih = np.clip(np.minimum(a[..., 1] + a[..., 3], b[..., 1] + b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    inter = iw * ih
+    iou = inter / np.maximum(a[..., 2] * a[..., 3] + b[..., 2] * b[..., 3] - inter, 1e-6)
+    matched = 0
+    used_a, used_b = set(), set()
+    for i, j in zip(*np.unravel_index(np.argsort(-iou, axis=None), iou.shape)):
+        if iou[i, j] < iou_threshold:
+            break
+        if i in used_a or j in used_b:
+            continue
+        used_a.add(i)
+        used_b.add(j)
+        matched += 1
+    return matched
+
+
+def agreement(detections, reference):
+    """在两者都做了完整检测的帧上，以 reference 为基准统计召回率和精确率"""
+    common = sorted(detections.keys() & reference.keys())
+    matched = sum(match_count(detections[i], reference[i]) for i in common)
+    found = sum(len(detections[i]) for i in common)
+    expected = sum(len(reference[i]) for i in common)
+    return {
+        "frames": len(common),
+        "recall": matched / expected if expected else None,
+        "precision": matched / found if found else None,
+    }
+
+
+def run_resolution(app, detector, frames, target_size, detect_max_width, detect_interval, warmup):
+    """
+    按 3-7.py 的处理顺序跑完所有帧，返回该目标分辨率下的统计结果和各帧完整检测的结果
+    （{帧序号: 原始画面坐标的 (N, 5) 框}，用于后端之间比较）。
+    """
+    target_w, target_h = target_size
+    geometry_cache = {}
+    display = app.DisplayBuffer()
+    tracker = app.FaceTracker() if detect_interval > 1 else None
+    timings = {stage: [] for stage in STAGES}
+    frame_totals = []
+    face_counts = []
+    input_size = None
+    faces = app.FaceSet()
+    since_detect = detect_interval
+    detections = {}
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    wall_start = None
+    for index, frame in enumerate(frames):
+        if index == warmup:
+            wall_start = time.perf_counter()
+        stamps = [time.perf_counter()]
+
+        # resize_cover：镜像、缩放、裁剪到显示尺寸
+        frame_h, frame_w = frame.shape[:2]
+        key = (frame.shape, target_w, target_h, True)
+        geometry = geometry_cache.get(key)
+        if geometry is None:
+            geometry = geometry_cache[key] = app.CoverGeometry(frame.shape, target_w, target_h, True)
+        img = geometry.apply(frame)
+        stamps.append(time.perf_counter())
+
+        # 检测输入：摄像头原始画面或按档位缩小
+        det_img = app.detection_input(frame, detect_max_width)
+        det_h, det_w = det_img.shape[:2]
+        if input_size != (det_w, det_h):
+            detector.set_input_size((det_w, det_h))
+            input_size = (det_w, det_h)
+            if tracker is not None:
+                tracker.clear()
+        stamps.append(time.perf_counter())
+
+        # 检测（或光流跟踪）
+        rows = None
+        tracked = None
+        if tracker is not None:
+            gray = cv2.cvtColor(det_img, cv2.COLOR_BGR2GRAY)
+            if since_detect < detect_interval:
+                tracked = tracker.track(gray)
+        if tracked is None:
+            rows = detector.detect_rows(det_img)
+            since_detect = 0
+        since_detect += 1
+        stamps.append(time.perf_counter())
+
+        # 有效性过滤与坐标换算
+        if tracked is None:
+            det_faces = app.FaceSet.from_detections(rows)
+            if tracker is not None:
+                tracker.reset(gray, det_faces)
+        else:
+            det_faces = tracked
+        scale, x_off, y_off = app.cover_transform(frame_w, frame_h, target_w, target_h)
+        faces = det_faces.mapped(frame_w / det_w).mapped(scale, x_off, y_off).visible_in(target_w, target_h)
+        stamps.append(time.perf_counter())
+
+        # 显示转换、绘制人脸框、生成 QPixmap
+        buffer = display.load(img)
+        stamps.append(time.perf_counter())
+        faces.draw(buffer, app.FACE_COLOR, 2)
+        stamps.append(time.perf_counter())
+        display.to_pixmap()
+        stamps.append(time.perf_counter())
+
+        if index >= warmup:
+            for stage, start, end in zip(STAGES, stamps, stamps[1:]):
+                timings[stage].append((end - start) * 1000)
+            frame_totals.append((stamps[-1] - stamps[0]) * 1000)
+            face_counts.append(len(faces))
+            if rows is not None:
+                source_boxes = rows[:, app.DetectorBackend.BOX_COLUMNS]
+                source_boxes[:, :4] *= frame_w / det_w
+                detections[index] = source_boxes
+
+    wall = time.perf_counter() - wall_start
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    measured = len(frame_totals)
+    return detections, {
+        "target": f"{target_w}x{target_h}",
+        "detect_input": f"{input_size[0]}x{input_size[1]}",
+        "frames": measured,
+        "fps": measured / wall if wall > 0 else 0.0,
+        "frame_ms": percentiles(frame_totals),
+        "stages_ms": {stage: percentiles(samples) for stage, samples in timings.items()},
+        "faces_mean": float(np.mean(face_counts)),
+        "traced_peak_mb": traced_peak / (1024 * 1024),
+        "process_peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def print_comparison(results):
+    """各检测后端在同一目标分辨率下的对比"""
+    print(f"\n{'目标分辨率':<12}{'后端':<28}{'帧率':>8}{'检测p50':>10}{'检测p90':>10}{'人脸数':>8}{'召回':>8}{'精确':>8}")
+    for result in results:
+        config = result["backend"]
+        if "tile_size" in result:
+            config += f" 分块{result['tile_size']}/{result['tile_overlap']}"
+        match = result.get("agreement") or {}
+        recall = f"{match['recall']:.2f}" if match.get("recall") is not None else "-"
+        precision = f"{match['precision']:.2f}" if match.get("precision") is not None else "-"
+        detect = result["stages_ms"]["detect"]
+        print(f"{result['target']:<14}{config:<30}{result['fps']:>8.1f}{detect['p50']:>10.2f}{detect['p90']:>10.2f}"
+              f"{result['faces_mean']:>9.1f}{recall:>9}{precision:>9}")
+
+
+def print_report(result):
+    tiling = f"，分块 {result['tile_size']} 重叠 {result['tile_overlap']}" if "tile_size" in result else ""
+    print(f"\n目标分辨率 {result['target']}（{result['backend']}，检测输入 {result['detect_input']}{tiling}，"
+          f"{result['frames']} 帧，平均 {result['faces_mean']:.1f} 张人脸）")
+    print(f"  持续帧率 {result['fps']:.1f} fps，单帧 p50 {result['frame_ms']['p50']:.2f} ms，"
+          f"p99 {result['frame_ms']['p99']:.2f} ms")
+    print(f"  {'阶段':<16}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}  (ms)")
+    for stage, stats in result["stages_ms"].items():
+        print(f"  {stage:<18}{stats['p50']:>9.2f}{stats['p90']:>9.2f}{stats['p99']:>9.2f}{stats['max']:>9.2f}")
+    rss = result["process_peak_rss_mb"]
+    rss_text = f"{rss:.1f} MB" if rss is not None else "不可用"
+    print(f"  内存峰值：numpy/Python 分配 {result['traced_peak_mb']:.1f} MB，进程 RSS {rss_text}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Face Random 检测路径无界面基准测试")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--video", help="输入视频文件（帧数不够时循环）")
+    source.add_argument("--synthetic", default="1280x720", help="合成画面分辨率，默认 1280x720")
+    parser.add_argument("--resolutions", default="1280x720,1920x1080,3840x2160",
+                        help="逗号分隔的目标显示分辨率")
+    parser.add_argument("--frames", type=int, default=120, help="每个分辨率统计的帧数")
+    parser.add_argument("--warmup", type=int, default=10, help="不计入统计的预热帧数")
+    parser.add_argument("--detect-width", type=int, default=1280,
+                        help="检测分辨率上限（宽度），0 表示始终用原始分辨率")
+    parser.add_argument("--detect-interval", type=int, default=1,
+                        help="每隔几帧完整检测一次，中间帧光流跟踪；默认 1 即每帧检测")
+    parser.add_argument("--tiles", action="store_true", help="使用分块检测（原始分辨率，忽略 --detect-width）")
+    parser.add_argument("--tile-size", default="640", help="逗号分隔的分块边长，逐个组合测试")
+    parser.add_argument("--tile-overlap", default="128", help="逗号分隔的分块重叠像素，逐个组合测试")
+    parser.add_argument("--tile-workers", type=int, default=None, help="分块检测线程数，默认 CPU 核数")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="YuNet ONNX 模型路径")
+    parser.add_argument("--backends", default="yunet",
+                        help="逗号分隔的检测后端（yunet、mediapipe、haar），在同一段画面上逐个测试")
+    parser.add_argument("--reference", default="yunet",
+                        help="统计召回率和精确率时作为基准的后端，默认 yunet")
+    parser.add_argument("--json", help="把结果写入 JSON 文件，- 表示输出到标准输出")
+    args = parser.parse_args(argv)
+
+    qt_app = QGuiApplication.instance() or QGuiApplication(sys.argv[:1])
+    app = load_app_module()
+
+    total = args.frames + args.warmup
+    if args.video:
+        frames = video_frames(args.video, total)
+        source_desc = args.video
+    else:
+        frames = synthetic_frames(parse_size(args.synthetic), total)
+        source_desc = f"synthetic:{args.synthetic}"
+
+    cv2.setUseOptimized(True)
+    detectors = []
+    for name in (v.strip() for v in args.backends.split(",")):
+        if name == "yunet" and args.tiles:
+            # 每种分块参数一个检测器；分块检测在原始分辨率上进行
+            detectors += [
+                ({"backend": name, "tile_size": size, "tile_overlap": overlap},
+                 app.YuNetBackend(detector=app.TiledDetector(args.model, size, overlap, workers=args.tile_workers)))
+                for size in (int(v) for v in args.tile_size.split(","))
+                for overlap in (int(v) for v in args.tile_overlap.split(","))
+            ]
+            continue
+        try:
+            detector = app.create_backend(name, model=args.model) if name == "yunet" else app.create_backend(name)
+        except Exception as e:
+            print(f"跳过检测后端 {name}: {e}")
+            continue
+        detectors.append(({"backend": name}, detector))
+    if not detectors:
+        raise SystemExit("没有可用的检测后端")
+    detect_max_width = None if args.tiles else args.detect_width or None
+
+    results = []
+    reference = {}  # 目标分辨率 -> 基准后端各帧的检测结果
+    pending = []  # (结果, 各帧检测结果)，等基准后端跑完再比较
+    for config, detector in detectors:
+        for size_text in args.resolutions.split(","):
+            detections, result = run_resolution(app, detector, frames, parse_size(size_text.strip()),
+                                                detect_max_width, max(1, args.detect_interval), args.warmup)
+            result.update(config)
+            results.append(result)
+            if config["backend"] == args.reference and result["target"] not in reference:
+                reference[result["target"]] = detections
+            pending.append((result, detections))
+            if args.json != "-":
+                print_report(result)
+        detector.close()
+
+    for result, detections in pending:
+        if result["target"] in reference:
+            result["agreement"] = dict(agreement(detections, reference[result["target"]]), reference=args.reference)
+    if len(detectors) > 1 and args.json != "-":
+        print_comparison(sorted(results, key=lambda r: (parse_size(r["target"]), -r["fps"])))
+
+    report = {
+        "source": source_desc,
+        "source_size": f"{frames[0].shape[1]}x{frames[0].shape[0]}",
+        "detect_width": detect_max_width,
+        "detect_interval": max(1, args.detect_interval),
+        "opencv": cv2.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+    if args.json == "-":
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    elif args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已写入 {args.json}")
+
+
+if __name__ == "__main__":
+    main()